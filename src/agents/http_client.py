@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP transport for MWS GPT requests
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_POOL_SIZE, HTTP_MAX_CONCURRENCY, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX
+)
+
+# Статусы, при которых повтор запроса имеет смысл
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Методы, которые можно безопасно повторить после таймаута чтения
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+class HTTPClient:
+    """
+    Pooled HTTP client with timeouts, retries and a concurrency cap.
+    
+    A single requests.Session keeps connections alive between calls, so only
+    the first request to a host pays for the TCP and TLS handshake. Transient
+    failures are retried with exponential backoff and full jitter. The async
+    methods run the same requests in a thread pool, so the concurrency cap
+    covers sync and async callers alike.
+    """
+    
+    def __init__(self, pool_size=HTTP_POOL_SIZE, max_concurrency=HTTP_MAX_CONCURRENCY,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX):
+        """
+        Initialize the HTTP client.
+        
+        Args:
+            pool_size (int): Keep-alive connections per host
+            max_concurrency (int): Maximum number of requests in flight
+            connect_timeout (float): Connection timeout in seconds
+            read_timeout (float): Read timeout in seconds
+            retries (int): Attempts per request
+            backoff_base (float): Delay before the second attempt in seconds
+            backoff_max (float): Upper bound for a single delay in seconds
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=max(pool_size, max_concurrency))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="http-client")
+    
+    def _backoff(self, attempt, response=None):
+        """
+        Delay before the next attempt: Retry-After if the server sent it, otherwise full jitter.
+        
+        Args:
+            attempt (int): Number of the failed attempt, starting from 0
+            response (requests.Response): Failed response, if any
+            
+        Returns:
+            float: Delay in seconds
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def request(self, method, url, retries=None, timeout=None, retry_read_timeouts=None, **kwargs):
+        """
+        Send a request, retrying connection errors, 429 and 5xx.
+        
+        A read timeout means the server may already have processed the request,
+        so it is retried only for idempotent methods unless the caller opts in.
+        
+        Args:
+            method (str): HTTP method
+            url (str): Request URL
+            retries (int): Attempts for this request (defaults to the client setting)
+            timeout (float or tuple): Timeout for this request (defaults to the client setting)
+            retry_read_timeouts (bool): Retry read timeouts (defaults to True for idempotent methods)
+            **kwargs: Passed to requests.Session.request
+            
+        Returns:
+            requests.Response: Successful response
+        """
+        retries = max(1, self.retries if retries is None else retries)
+        timeout = timeout or self.timeout
+        if retry_read_timeouts is None:
+            retry_read_timeouts = method.upper() in IDEMPOTENT_METHODS
+        retryable = (requests.exceptions.ConnectionError, requests.exceptions.Timeout) if retry_read_timeouts \
+            else requests.exceptions.ConnectionError # Включает ConnectTimeout: запрос не был отправлен
+        
+        for attempt in range(retries):
+            response = None
+            try:
+                with self._semaphore:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                if attempt == retries - 1:
+                    response.raise_for_status()
+                error = f"HTTP {response.status_code}"
+                response.close() # Возвращаем соединение в пул до паузы
+            except retryable as e:
+                if attempt == retries - 1:
+                    raise
+                error = str(e)
+            
+            delay = self._backoff(attempt, response)
+            logging.warning(f"Запрос {url} не удался ({error}), попытка {attempt + 2}/{retries} через {delay:.1f} с")
+            time.sleep(delay)
+    
+    def post(self, url, **kwargs):
+        """
+        Send a POST request.
+        
+        Args:
+            url (str): Request URL
+            **kwargs: Passed to request
+            
+        Returns:
+            requests.Response: Successful response
+        """
+        return self.request("POST", url, **kwargs)
+    
+    def post_json(self, url, payload, headers=None, **kwargs):
+        """
+        Send a JSON POST request and decode the JSON response.
+        
+        Args:
+            url (str): Request URL
+            payload (dict): Request body
+            headers (dict): Request headers
+            **kwargs: Passed to request
+            
+        Returns:
+            dict: Decoded response
+        """
+        return self.post(url, json=payload, headers=headers, **kwargs).json()
+    
+    async def arequest(self, method, url, **kwargs):
+        """
+        Async version of request, executed in the client's thread pool.
+        
+        Args:
+            method (str): HTTP method
+            url (str): Request URL
+            **kwargs: Passed to request
+            
+        Returns:
+            requests.Response: Successful response
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.request, method, url, **kwargs))
+    
+    async def apost_json(self, url, payload, headers=None, **kwargs):
+        """
+        Async version of post_json.
+        
+        Args:
+            url (str): Request URL
+            payload (dict): Request body
+            headers (dict): Request headers
+            **kwargs: Passed to request
+            
+        Returns:
+            dict: Decoded response
+        """
+        response = await self.arequest("POST", url, json=payload, headers=headers, **kwargs)
+        return response.json()
+    
+    def close(self):
+        """Close pooled connections and stop the thread pool."""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    """
+    Get the process-wide HTTP client, creating it on first use.
+    
+    Returns:
+        HTTPClient: Shared client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HTTPClient()
+    return _client
@@ -1,4 +1,5 @@
 from .embedding_provider import EmbeddingProvider
 from .api_embedding_provider import APIEmbeddingProvider
 from .local_embedding_provider import LocalEmbeddingProvider
+from .embedding_cache import EmbeddingCache, CachedEmbeddingProvider
 from .search_engine import SemanticSearch
@@ -1,14 +1,23 @@
 import requests
 import json
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
 from .embedding_provider import EmbeddingProvider
+from ..http_client import HTTPClient, get_http_client
+
+# HTTP statuses meaning the request was rejected as too large: retrying the same
+# batch will not help, but smaller batches may succeed. Other client errors (400, 422)
+# mean invalid input and are raised without splitting
+SPLIT_STATUSES = (413,)
 
 # APIEmbeddingProvider
 class APIEmbeddingProvider(EmbeddingProvider):
     """Embedding provider that uses remote API."""
     
     def __init__(self, api_key: str, api_base_url: str = "https://api.gpt.mws.ru/v1", 
-                 model: str = "bge-m3"):
+                 model: str = "bge-m3", batch_size: int = 64, max_concurrency: int = 4,
+                 max_retries: int = 3, http_client: Optional[HTTPClient] = None):
         """
         Initialize API embedding provider.
         
@@ -16,11 +25,22 @@ class APIEmbeddingProvider(EmbeddingProvider):
             api_key: API key for authentication
             api_base_url: Base URL for the API
             model: Model name to use for embeddings
+            batch_size: Maximum number of texts sent in one embeddings request; lowered while
+                the API rejects large batches and raised back after successful requests
+            max_concurrency: Maximum number of batch requests in flight at once
+            max_retries: Attempts per request for transient errors (timeouts, 429, 5xx)
+            http_client: HTTP client to use, the shared pooled client by default
         """
         self.api_key = api_key
         self.api_base_url = api_base_url
         self.embedding_endpoint = f"{api_base_url}/embeddings"
         self.model = model
+        self.batch_size = batch_size
+        self._current_batch_size = batch_size
+        self._batch_size_lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.http_client = http_client or get_http_client()
     
     def get_embedding(self, text: str) -> List[float]:
         """
@@ -35,6 +55,18 @@ class APIEmbeddingProvider(EmbeddingProvider):
         if not text:
             raise ValueError("Input text cannot be empty.")
 
+        return self._request_embeddings([text])[0]
+
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Send a single embeddings request with a list input.
+        
+        Args:
+            texts: Non-empty texts to embed
+            
+        Returns:
+            List of embeddings in the order of the input texts
+        """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -42,19 +74,22 @@ class APIEmbeddingProvider(EmbeddingProvider):
 
         payload = {
             "model": self.model,
-            "input": text,
+            "input": texts,
         }
 
         try:
-            response = requests.post(self.embedding_endpoint, headers=headers, json=payload)
+            response = self.http_client.post(self.embedding_endpoint, headers=headers, json=payload,
+                                             retries=self.max_retries, retry_read_timeouts=True)
             response.raise_for_status()
 
             response_data = response.json()
 
-            if "data" in response_data and isinstance(response_data["data"], list) and len(response_data["data"]) > 0:
-                if "embedding" in response_data["data"][0] and isinstance(response_data["data"][0]["embedding"], list):
-                    embedding = response_data["data"][0]["embedding"]
-                    return embedding
+            if "data" in response_data and isinstance(response_data["data"], list) and len(response_data["data"]) == len(texts):
+                # The API may return items out of order; "index" refers to the position in the input list
+                items = sorted(response_data["data"], key=lambda item: item.get("index", 0))
+                embeddings = [item.get("embedding") for item in items]
+                if all(isinstance(embedding, list) for embedding in embeddings):
+                    return embeddings
                 else:
                     raise ValueError("API response format error: 'embedding' key missing or not a list.")
             else:
@@ -73,7 +108,7 @@ class APIEmbeddingProvider(EmbeddingProvider):
             print(error_message)
             raise
         
-        except (KeyError, IndexError, TypeError, ValueError) as e:
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
             error_message = f"Failed to parse API response: {e}"
             print(error_message)
             raise ValueError(error_message) from e
@@ -82,10 +117,109 @@ class APIEmbeddingProvider(EmbeddingProvider):
         """
         Generate embeddings for multiple texts.
         
+        Texts are sent in requests of up to batch_size items, with at most
+        max_concurrency requests in flight. A batch the API rejects as too large
+        is split in half; transient errors are retried by the HTTP client and
+        then raised.
+        
         Args:
             texts: List of texts to embed
             
         Returns:
             List of embeddings
         """
-        return [self.get_embedding(text) for text in texts]
+        if any(not text for text in texts):
+            raise ValueError("Input text cannot be empty.")
+        return self._map_batches(texts, self._embed_batch)
+
+    def try_get_batch_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for multiple texts, with None for texts that could not be embedded.
+        
+        A failed batch only affects its own texts: results of the other batches are kept.
+        
+        Args:
+            texts: List of texts to embed
+            
+        Returns:
+            List of embeddings, None for empty, rejected or failed texts
+        """
+        valid = [i for i, text in enumerate(texts) if text]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for i, embedding in zip(valid, self._map_batches([texts[i] for i in valid], self._try_embed_batch)):
+            embeddings[i] = embedding
+        return embeddings
+
+    def _map_batches(self, texts: List[str], embed: Callable[[List[str]], List]) -> List:
+        """
+        Split texts into batches and embed them concurrently.
+        
+        Args:
+            texts: Texts to embed
+            embed: Function embedding one batch
+            
+        Returns:
+            Flat list of per-text results in the order of texts
+        """
+        if not texts:
+            return []
+
+        with self._batch_size_lock:
+            batch_size = self._current_batch_size
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [embed(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(embed, batches))
+
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    def _embed_batch(self, texts: List[str], skip_rejected: bool = False,
+                     parent_status: Optional[int] = None) -> List[Optional[List[float]]]:
+        """
+        Embed one batch, splitting it when the API rejects it as too large.
+        
+        Transient errors (connection errors, timeouts, 429, 5xx) are already
+        retried with backoff by the HTTP client and are raised as is.
+        
+        Args:
+            texts: Texts of the batch
+            skip_rejected: Return None for a single text of a split batch that is
+                rejected like the batch itself instead of raising
+            parent_status: Status the enclosing batch was rejected with, if it was split
+            
+        Returns:
+            List of embeddings for the batch
+        """
+        try:
+            embeddings = self._request_embeddings(texts)
+        except requests.exceptions.HTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            if status not in SPLIT_STATUSES:
+                raise
+            if len(texts) == 1:
+                # Splitting did not help: this text alone is rejected like its batch
+                if skip_rejected and status == parent_status:
+                    return [None]
+                raise
+            half = len(texts) // 2
+            with self._batch_size_lock:
+                self._current_batch_size = max(1, min(self._current_batch_size, half))
+            print(f"Embedding batch of {len(texts)} rejected (HTTP {status}), retrying as two batches of up to {len(texts) - half}")
+            return (self._embed_batch(texts[:half], skip_rejected, status)
+                    + self._embed_batch(texts[half:], skip_rejected, status))
+
+        # Batches of the current size go through again: let the size grow back towards batch_size
+        with self._batch_size_lock:
+            if len(texts) >= self._current_batch_size:
+                self._current_batch_size = min(self.batch_size, self._current_batch_size * 2)
+        return embeddings
+
+    def _try_embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed one batch for try_get_batch_embeddings: a failure gives None for this batch only."""
+        try:
+            return self._embed_batch(texts, skip_rejected=True)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Embedding batch of {len(texts)} failed: {e}")
+            return [None] * len(texts)
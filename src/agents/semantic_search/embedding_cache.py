@@ -0,0 +1,374 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Dict
+import numpy as np
+
+from .embedding_provider import EmbeddingProvider
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes
+    fcntl = None
+
+# Persistent embedding cache
+class EmbeddingCache:
+    """
+    Disk-backed cache of float32 embedding vectors keyed by text hash.
+    
+    Vectors are appended to a raw float32 file that is read through a memory
+    map, and an append-only index maps each key to its row. Recently used
+    vectors are also kept in an in-memory LRU bounded by size in bytes.
+    Several processes may share a cache directory: appends are serialized
+    with an exclusive file lock (where fcntl is available), and each writer
+    picks up index entries appended by the others before writing its own.
+    """
+    
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.tsv"
+    META_FILE = "meta.json"
+    LOCK_FILE = "cache.lock"
+    
+    def __init__(self, cache_dir: str, memory_bytes: int = 64 * 2**20):
+        """
+        Open (or create) an embedding cache.
+        
+        Args:
+            cache_dir: Directory holding the cache files
+            memory_bytes: Size limit of the in-memory LRU
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.dimension: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        
+        self._rows: Dict[str, int] = {}
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lru_bytes = 0
+        self._vectors = None  # Memory map, recreated after appends
+        self._vector_file = None
+        self._index_file = None
+        self._index_offset = 0  # Bytes of the index file already read into _rows
+        self._lock = threading.Lock()
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+    
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Content key of a text: hash of the text after Unicode and whitespace normalization.
+        
+        Args:
+            text: Text to hash
+            
+        Returns:
+            Hex digest used as the cache key
+        """
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+    
+    @contextmanager
+    def _file_lock(self):
+        """Hold the exclusive lock shared by all processes using this cache directory."""
+        with open(self._path(self.LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read_meta(self):
+        meta_path = self._path(self.META_FILE)
+        if self.dimension is None and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dimension = json.load(f)["dimension"]
+    
+    def _vector_rows(self) -> int:
+        """Number of complete vectors on disk, truncating a partially written trailing one."""
+        vectors_path = self._path(self.VECTORS_FILE)
+        row_bytes = self.dimension * 4
+        size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        if size % row_bytes:
+            # Left by an interrupted write; only safe under the file lock
+            with open(vectors_path, "r+b") as f:
+                f.truncate(size - size % row_bytes)
+        return size // row_bytes
+    
+    def _sync_index(self, rows: int):
+        """
+        Read index entries appended since the last call, by this or another process.
+        
+        Args:
+            rows: Number of complete vectors on disk; entries beyond it are ignored
+        """
+        index_path = self._path(self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1  # A trailing partial line is left for later
+        self._index_offset += complete
+        for line in data[:complete].decode("utf-8").splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < rows:
+                self._rows.setdefault(parts[0], int(parts[1]))
+    
+    def _load(self):
+        """Read the index, dropping entries whose vectors were not fully written."""
+        with self._file_lock():
+            self._read_meta()
+            if self.dimension is None:
+                return
+            self._sync_index(self._vector_rows())
+        print(f"Loaded embedding cache from {self.cache_dir}: {len(self._rows)} vectors, dimension {self.dimension}")
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def __contains__(self, text: str) -> bool:
+        return self.key(text) in self._rows
+    
+    def _remember(self, key: str, vector: np.ndarray):
+        """Put a vector into the LRU and evict the least recently used ones over the size limit."""
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return
+        self._lru[key] = vector
+        self._lru_bytes += vector.nbytes
+        while self._lru_bytes > self.memory_bytes and len(self._lru) > 1:
+            _, evicted = self._lru.popitem(last=False)
+            self._lru_bytes -= evicted.nbytes
+    
+    def _read(self, row: int) -> np.ndarray:
+        if self._vectors is None or row >= self._vectors.shape[0]:
+            if self._vector_file is not None:
+                self._vector_file.flush()
+            rows = os.path.getsize(self._path(self.VECTORS_FILE)) // (self.dimension * 4)
+            self._vectors = np.memmap(self._path(self.VECTORS_FILE), dtype=np.float32, mode="r",
+                                      shape=(rows, self.dimension))
+        return np.array(self._vectors[row])
+    
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up vectors for several texts.
+        
+        Args:
+            texts: Texts to look up
+            
+        Returns:
+            List with a float32 vector for each cached text and None for the rest
+        """
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                elif key in self._rows:
+                    vector = self._read(self._rows[key])
+                    self._remember(key, vector)
+                
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+    
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """
+        Look up the vector for a text.
+        
+        Args:
+            text: Text to look up
+            
+        Returns:
+            Float32 vector or None if the text is not cached
+        """
+        return self.get_many([text])[0]
+    
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """
+        Store vectors for several texts.
+        
+        Args:
+            texts: Texts the vectors belong to
+            vectors: Embeddings in the same order as texts
+        """
+        if not texts:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        if array.ndim != 2 or array.shape[0] != len(texts):
+            raise ValueError(f"Expected {len(texts)} vectors, got array of shape {array.shape}")
+        
+        with self._lock, self._file_lock():
+            self._read_meta()  # Another process may have created the cache meanwhile
+            if self.dimension is None:
+                self.dimension = array.shape[1]
+                with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"dimension": self.dimension}, f)
+            elif array.shape[1] != self.dimension:
+                raise ValueError(f"Cache dimension is {self.dimension}, got vectors of dimension {array.shape[1]}")
+            
+            if self._vector_file is None:
+                self._vector_file = open(self._path(self.VECTORS_FILE), "ab")
+                self._index_file = open(self._path(self.INDEX_FILE), "a", encoding="utf-8")
+            
+            # Rows come from the file itself: other processes may have appended since our last write
+            row = self._vector_rows()
+            self._sync_index(row)
+            new_keys, new_rows = [], []
+            for text, vector in zip(texts, array):
+                key = self.key(text)
+                if key not in self._rows:
+                    self._rows[key] = row + len(new_keys)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+            
+            # Vectors first, then the index: an interrupted write never leaves an index entry without data
+            try:
+                self._vector_file.write(np.stack(new_rows).tobytes())
+                self._vector_file.flush()
+                self._index_file.write("".join(f"{key}\t{self._rows[key]}\n" for key in new_keys))
+                self._index_file.flush()
+                self._index_offset = os.path.getsize(self._path(self.INDEX_FILE))
+            except OSError:
+                for key in new_keys:
+                    del self._rows[key]
+                raise
+            
+            for key, vector in zip(new_keys, new_rows):
+                self._remember(key, vector.copy())
+    
+    def put(self, text: str, vector: List[float]):
+        """
+        Store the vector for a text.
+        
+        Args:
+            text: Text the vector belongs to
+            vector: Embedding
+        """
+        self.put_many([text], [vector])
+    
+    def close(self):
+        """Close the cache files."""
+        with self._lock:
+            for f in (self._vector_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._vector_file = self._index_file = None
+            self._vectors = None
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """Embedding provider that serves repeated texts from a persistent cache."""
+    
+    def __init__(self, provider: EmbeddingProvider, cache_dir: str, memory_bytes: int = 64 * 2**20):
+        """
+        Wrap an embedding provider with a cache.
+        
+        Vectors of different providers and models are kept apart: each one gets
+        its own subdirectory of cache_dir.
+        
+        Args:
+            provider: Provider used for texts that are not cached yet
+            cache_dir: Root directory of the embedding cache
+            memory_bytes: Size limit of the in-memory LRU
+        """
+        self.provider = provider
+        model = getattr(provider, "model", None)
+        model = model if isinstance(model, str) else getattr(provider, "model_name", "default")
+        namespace = re.sub(r"[^\w.-]+", "_", f"{type(provider).__name__}-{model}")
+        self.cache = EmbeddingCache(os.path.join(cache_dir, namespace), memory_bytes)
+    
+    def get_embedding(self, text: str) -> List[float]:
+        """
+        Get the embedding for a single text, from the cache if possible.
+        
+        Args:
+            text: Text to embed
+            
+        Returns:
+            List of floats representing the embedding
+        """
+        if not text:
+            raise ValueError("Input text cannot be empty.")
+        
+        vector = self.cache.get(text)
+        if vector is not None:
+            return vector.tolist()
+        
+        embedding = self.provider.get_embedding(text)
+        self.cache.put(text, embedding)
+        return embedding
+    
+    def get_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get embeddings for multiple texts, sending only uncached ones to the provider.
+        
+        Args:
+            texts: List of texts to embed
+            
+        Returns:
+            List of embeddings
+        """
+        return self._cached_batch(texts, self.provider.get_batch_embeddings)
+    
+    def try_get_batch_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Like get_batch_embeddings, with None for texts the provider could not embed.
+        
+        Args:
+            texts: List of texts to embed
+            
+        Returns:
+            List of embeddings, None for texts without an embedding
+        """
+        return self._cached_batch(texts, self.provider.try_get_batch_embeddings)
+    
+    def _cached_batch(self, texts: List[str], embed) -> List[Optional[List[float]]]:
+        """
+        Serve cached texts from the cache and embed the rest with one provider call.
+        
+        Args:
+            texts: List of texts to embed
+            embed: Provider batch method used for uncached texts
+            
+        Returns:
+            List of embeddings in the order of texts
+        """
+        cached = self.cache.get_many(texts)
+        
+        # Each distinct missing text is embedded once, even if it repeats in the batch
+        missing: Dict[str, str] = {}
+        for text, vector in zip(texts, cached):
+            if vector is None:
+                missing.setdefault(self.cache.key(text), text)
+        
+        computed: Dict[str, Optional[List[float]]] = {}
+        if missing:
+            missing_texts = list(missing.values())
+            embeddings = embed(missing_texts)
+            stored = [(text, embedding) for text, embedding in zip(missing_texts, embeddings) if embedding is not None]
+            if stored:
+                self.cache.put_many([text for text, _ in stored], [embedding for _, embedding in stored])
+            computed = dict(zip(missing.keys(), embeddings))
+        
+        return [vector.tolist() if vector is not None else computed[self.cache.key(text)]
+                for text, vector in zip(texts, cached)]
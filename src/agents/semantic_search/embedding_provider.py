@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 
 # Abstract base class for embedding providers
 class EmbeddingProvider(ABC):
@@ -14,3 +14,19 @@ class EmbeddingProvider(ABC):
     def get_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Generate embeddings for a batch of texts."""
         pass
+    
+    def try_get_batch_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Generate embeddings for a batch, with None for texts that could not be embedded."""
+        try:
+            return self.get_batch_embeddings(texts)
+        except Exception as e:
+            print(f"Batch embedding of {len(texts)} texts failed: {e}, embedding them one by one")
+        
+        embeddings: List[Optional[List[float]]] = []
+        for text in texts:
+            try:
+                embeddings.append(self.get_embedding(text))
+            except Exception as e:
+                print(f"Error generating embedding for '{text[:50]}...': {e}")
+                embeddings.append(None)
+        return embeddings
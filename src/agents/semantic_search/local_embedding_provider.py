@@ -15,6 +15,7 @@ class LocalEmbeddingProvider(EmbeddingProvider):
         try:
             from sentence_transformers import SentenceTransformer
             self.model = SentenceTransformer(model_name_or_path)
+            self.model_name = model_name_or_path
             print(f"Loaded local model: {model_name_or_path}")
         except ImportError:
             raise ImportError(
@@ -8,6 +8,16 @@ import json
 from .embedding_provider import EmbeddingProvider
 from .api_embedding_provider import APIEmbeddingProvider
 from .local_embedding_provider import LocalEmbeddingProvider
+from .embedding_cache import CachedEmbeddingProvider
+
+# Supported FAISS index types: exact search and approximate (IVF, HNSW, IVF with product quantization)
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+INDEX_META_FILE = "index_meta.json"
+
+# "auto" picks the index type from the corpus size: ivf_pq once its codebooks can be trained, flat below that
+AUTO_INDEX_TYPE = "auto"
+# FAISS k-means wants at least 39 training points per centroid; an 8-bit PQ code has 256 centroids
+MIN_PQ_TRAINING_POINTS = 39 * 2 ** 8
 
 # Класс SemanticSearch для работы напрямую с FAISS и DataFrame
 class SemanticSearch:
@@ -27,18 +37,26 @@ class SemanticSearch:
         self.df = None
         self.text_column = None
         self.embedding_dimension = None
+        self.embedding_chunk_size = 1024
+        self.index_type = None
+        self.index_params: Dict[str, Any] = {}
         
     @classmethod
     def with_api_provider(cls, api_key: str, api_base_url: str = "https://api.gpt.mws.ru/v1", 
-                         model: str = "bge-m3"):
-        """Factory method to create a SemanticSearch with API provider."""
+                         model: str = "bge-m3", cache_dir: Optional[str] = None):
+        """Factory method to create a SemanticSearch with API provider, optionally cached in cache_dir."""
         provider = APIEmbeddingProvider(api_key, api_base_url, model)
+        if cache_dir:
+            provider = CachedEmbeddingProvider(provider, cache_dir)
         return cls(provider)
     
     @classmethod
-    def with_local_provider(cls, model_name_or_path: str = "sentence-transformers/all-MiniLM-L6-v2"):
-        """Factory method to create a SemanticSearch with local provider."""
+    def with_local_provider(cls, model_name_or_path: str = "sentence-transformers/all-MiniLM-L6-v2",
+                            cache_dir: Optional[str] = None):
+        """Factory method to create a SemanticSearch with local provider, optionally cached in cache_dir."""
         provider = LocalEmbeddingProvider(model_name_or_path)
+        if cache_dir:
+            provider = CachedEmbeddingProvider(provider, cache_dir)
         return cls(provider)
         
     def load_index(self, df_path: str, index_path: str, text_column: str = "name"):
@@ -67,13 +85,26 @@ class SemanticSearch:
             # Get embedding dimension from index
             self.embedding_dimension = self.faiss_index.d
             
-            print(f"Loaded DataFrame with {len(self.df)} items and FAISS index with dimension {self.embedding_dimension}")
+            # Index type and default search parameters are saved next to the index
+            meta_path = os.path.join(os.path.dirname(index_path), INDEX_META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.index_type = meta.get("index_type", "flat")
+                self.index_params = meta.get("params", {})
+            else:
+                self.index_type = self._detect_index_type(self.faiss_index)
+                self.index_params = {}
+            self._apply_search_defaults()
+            
+            print(f"Loaded DataFrame with {len(self.df)} items and FAISS index ({self.index_type}) with dimension {self.embedding_dimension}")
         except Exception as e:
             print(f"Error loading DataFrame or index: {e}")
             raise
     
     def create_index_from_dataframe(self, df: pd.DataFrame, text_column: str = "name",
-                                   save_path: Optional[str] = None):
+                                   save_path: Optional[str] = None, index_type: str = "flat",
+                                   index_params: Optional[Dict[str, Any]] = None):
         """
         Create a FAISS index from a pandas DataFrame.
         
@@ -81,42 +112,25 @@ class SemanticSearch:
             df: DataFrame containing the corpus
             text_column: Column name containing the text to be embedded
             save_path: Optional path to save the created index and DataFrame
+            index_type: One of INDEX_TYPES: "flat", "ivf_flat", "hnsw" or "ivf_pq", or "auto"
+            index_params: Optional overrides for automatically chosen index parameters
         """
         self.text_column = text_column
         self.df = df.copy()
         
         print(f"Creating index from DataFrame with {len(df)} rows...")
         
-        # Generate embeddings for each text
-        embeddings = []
+        # Generate embeddings in batches
         print("Generating embeddings (this may take some time)...")
-        
-        for i, text in enumerate(df[text_column]):
-            try:
-                if i % 100 == 0 and i > 0:
-                    print(f"  Processed {i}/{len(df)} items...")
-                
-                embedding = self.embedding_provider.get_embedding(text)
-                embeddings.append(embedding)
-                
-            except Exception as e:
-                print(f"Error generating embedding for '{text[:50]}...': {e}")
-                # Use zeros as placeholder
-                if embeddings:  # If we already have at least one embedding, use its dimension
-                    placeholder = [0.0] * len(embeddings[0])
-                else:
-                    # Assume default dimension is 1024 for BGE-M3
-                    placeholder = [0.0] * 1024
-                embeddings.append(placeholder)
+        embeddings = self._generate_embeddings(df[text_column].tolist())
         
         # Convert to numpy array
         embeddings_array = np.array(embeddings).astype('float32')
         self.embedding_dimension = embeddings_array.shape[1]
         
         # Create FAISS index
-        print(f"Creating FAISS index with dimension {self.embedding_dimension}...")
-        self.faiss_index = faiss.IndexFlatL2(self.embedding_dimension)
-        self.faiss_index.add(embeddings_array)
+        print(f"Creating FAISS index ({index_type}) with dimension {self.embedding_dimension}...")
+        self.faiss_index = self._build_faiss_index(embeddings_array, index_type, index_params)
         
         # Save if requested
         if save_path:
@@ -125,13 +139,16 @@ class SemanticSearch:
         print(f"Index creation complete, {len(embeddings)} items indexed")
         return self.faiss_index
     
-    def create_index_from_processed_json(self, json_path: str, save_path: Optional[str] = None):
+    def create_index_from_processed_json(self, json_path: str, save_path: Optional[str] = None,
+                                         index_type: str = "flat", index_params: Optional[Dict[str, Any]] = None):
         """
         Создает FAISS индекс из обработанного JSON файла со структурой {name, content_data}.
         
         Args:
             json_path: Путь к JSON-файлу с обработанными данными
             save_path: Опциональный путь для сохранения индекса и DataFrame
+            index_type: Тип индекса из INDEX_TYPES: "flat", "ivf_flat", "hnsw" или "ivf_pq", либо "auto"
+            index_params: Опциональные значения вместо автоматически подобранных параметров индекса
         """
         # Загрузка данных из JSON
         print(f"Загрузка данных из {json_path}...")
@@ -144,35 +161,21 @@ class SemanticSearch:
         
         print(f"Создание индекса из DataFrame с {len(self.df)} строками...")
         
-        # Генерация эмбеддингов для каждого name
-        embeddings = []
+        # Генерация эмбеддингов пакетами
         print("Генерация эмбеддингов (это может занять некоторое время)...")
-        
-        for i, text in enumerate(self.df[self.text_column]):
-            try:
-                if i % 100 == 0 and i > 0:
-                    print(f"  Обработано {i}/{len(self.df)} элементов...")
-                
-                embedding = self.embedding_provider.get_embedding(text)
-                embeddings.append(embedding)
-                
-            except Exception as e:
-                print(f"Ошибка при создании эмбеддинга для '{text[:50]}...': {e}")
-                # Заполняем нулями
-                if embeddings:
-                    placeholder = [0.0] * len(embeddings[0])
-                else:
-                    placeholder = [0.0] * 1024
-                embeddings.append(placeholder)
+        embeddings = self._generate_embeddings(
+            self.df[self.text_column].tolist(),
+            progress_message="  Обработано {done}/{total} элементов...",
+            error_message="Ошибка при создании эмбеддинга для '{text}...': {error}",
+        )
         
         # Конвертация в numpy массив
         embeddings_array = np.array(embeddings).astype('float32')
         self.embedding_dimension = embeddings_array.shape[1]
         
         # Создание FAISS индекса
-        print(f"Создание FAISS индекса с размерностью {self.embedding_dimension}...")
-        self.faiss_index = faiss.IndexFlatL2(self.embedding_dimension)
-        self.faiss_index.add(embeddings_array)
+        print(f"Создание FAISS индекса ({index_type}) с размерностью {self.embedding_dimension}...")
+        self.faiss_index = self._build_faiss_index(embeddings_array, index_type, index_params)
         
         # Сохранение при необходимости
         if save_path:
@@ -181,6 +184,164 @@ class SemanticSearch:
         print(f"Создание индекса завершено, {len(embeddings)} элементов проиндексировано")
         return self.faiss_index
     
+    def _generate_embeddings(self, texts: List[Any], chunk_size: Optional[int] = None,
+                             progress_message: str = "  Processed {done}/{total} items...",
+                             error_message: str = "Error generating embedding for '{text}...': {error}"
+                             ) -> List[List[float]]:
+        """
+        Generate embeddings for a corpus using the provider's batch API.
+        
+        Texts are passed to try_get_batch_embeddings in chunks of chunk_size, so
+        the provider can batch and parallelize requests. A failed request only
+        affects the texts of its own batch; those texts get zero vectors.
+        
+        Args:
+            texts: Texts to embed
+            chunk_size: Number of texts per try_get_batch_embeddings call
+            progress_message: Format string for progress output ({done}, {total})
+            error_message: Format string for per-text errors ({text}, {error})
+            
+        Returns:
+            List of embeddings in the order of the input texts
+        """
+        chunk_size = chunk_size or self.embedding_chunk_size
+        embeddings: List[Optional[List[float]]] = []
+        
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            # Empty and non-string values (e.g. NaN from the CSV) cannot be embedded
+            valid = [i for i, text in enumerate(chunk) if isinstance(text, str) and text]
+            chunk_embeddings: List[Optional[List[float]]] = [None] * len(chunk)
+            
+            batch = self.embedding_provider.try_get_batch_embeddings([chunk[i] for i in valid])
+            for i, embedding in zip(valid, batch):
+                chunk_embeddings[i] = embedding
+            
+            for i, embedding in enumerate(chunk_embeddings):
+                if embedding is None:
+                    reason = "embedding failed" if isinstance(chunk[i], str) and chunk[i] else "empty text"
+                    print(error_message.format(text=str(chunk[i])[:50], error=reason))
+            embeddings.extend(chunk_embeddings)
+            
+            done = start + len(chunk)
+            if done < len(texts):
+                print(progress_message.format(done=done, total=len(texts)))
+        
+        # Use zeros as placeholder for texts without an embedding
+        dimension = next((len(embedding) for embedding in embeddings if embedding is not None), 1024)  # 1024 for BGE-M3
+        return [embedding if embedding is not None else [0.0] * dimension for embedding in embeddings]
+    
+    @staticmethod
+    def _auto_index_params(index_type: str, n: int, d: int) -> Dict[str, Any]:
+        """
+        Choose index parameters from the corpus size and dimension.
+        
+        Args:
+            index_type: One of INDEX_TYPES
+            n: Number of vectors
+            d: Vector dimension
+            
+        Returns:
+            Dictionary of index parameters
+        """
+        if index_type == "hnsw":
+            return {"M": 32, "ef_construction": 200, "ef_search": 64}
+        if index_type not in ("ivf_flat", "ivf_pq"):
+            return {}
+        
+        # ~4*sqrt(N) lists, but at least 39 training points per centroid as FAISS k-means expects
+        nlist = int(max(1, min(4 * np.sqrt(n), n // 39)))
+        params = {"nlist": nlist, "nprobe": int(max(1, min(nlist, round(np.sqrt(nlist)))))}
+        if index_type == "ivf_pq":
+            # Sub-vectors of 8-16 dimensions with 8-bit codes (256 centroids per sub-quantizer)
+            m = next((m for m in range(max(1, d // 16), d + 1) if d % m == 0), d)
+            params.update({"m": m, "nbits": 8})
+        return params
+    
+    def _build_faiss_index(self, embeddings_array: np.ndarray, index_type: str = "flat",
+                           index_params: Optional[Dict[str, Any]] = None):
+        """
+        Build, train and fill a FAISS index of the requested type.
+        
+        Args:
+            embeddings_array: Float32 matrix of corpus embeddings
+            index_type: One of INDEX_TYPES or "auto"
+            index_params: Optional overrides for automatically chosen parameters
+            
+        Returns:
+            Filled FAISS index
+        """
+        if index_type != AUTO_INDEX_TYPE and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type '{index_type}', expected one of {INDEX_TYPES} or '{AUTO_INDEX_TYPE}'")
+        
+        n, d = embeddings_array.shape
+        if index_type == AUTO_INDEX_TYPE:
+            index_type = "ivf_pq" if n >= MIN_PQ_TRAINING_POINTS else "flat"
+            if index_type == "flat":
+                print(f"  {n} vectors are too few to train ivf_pq (needs {MIN_PQ_TRAINING_POINTS}), using exact flat index")
+        params = self._auto_index_params(index_type, n, d)
+        params.update(index_params or {})
+        
+        if index_type == "ivf_pq" and n < 39 * 2 ** params["nbits"]:
+            raise ValueError(f"ivf_pq with nbits={params['nbits']} needs at least {39 * 2 ** params['nbits']} vectors "
+                             f"to train, got {n}; use index_type='flat', 'ivf_flat' or '{AUTO_INDEX_TYPE}'")
+        
+        if index_type == "flat":
+            index = faiss.IndexFlatL2(d)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(d, params["M"])
+            index.hnsw.efConstruction = params["ef_construction"]
+        else:
+            quantizer = faiss.IndexFlatL2(d)
+            if index_type == "ivf_flat":
+                index = faiss.IndexIVFFlat(quantizer, d, params["nlist"])
+            else:
+                index = faiss.IndexIVFPQ(quantizer, d, params["nlist"], params["m"], params["nbits"])
+            print(f"  Training {index_type} index with parameters {params}...")
+            index.train(embeddings_array)
+        
+        index.add(embeddings_array)
+        self.index_type = index_type
+        self.index_params = params
+        self.faiss_index = index
+        self._apply_search_defaults()
+        return index
+    
+    @staticmethod
+    def _detect_index_type(index) -> str:
+        """Guess the index type of an index saved without metadata."""
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "ivf_pq"
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf_flat"
+        return "flat"
+    
+    def _apply_search_defaults(self):
+        """Set the default nprobe / efSearch of the current index from index_params."""
+        if self.index_type in ("ivf_flat", "ivf_pq") and "nprobe" in self.index_params:
+            faiss.extract_index_ivf(self.faiss_index).nprobe = int(self.index_params["nprobe"])
+        elif self.index_type == "hnsw" and "ef_search" in self.index_params:
+            self.faiss_index.hnsw.efSearch = int(self.index_params["ef_search"])
+    
+    def _search_parameters(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        Build per-call FAISS search parameters, leaving the index defaults untouched.
+        
+        Args:
+            nprobe: Number of IVF lists to visit (IVF indexes)
+            ef_search: Size of the HNSW candidate list (HNSW indexes)
+            
+        Returns:
+            FAISS SearchParameters or None to use the index defaults
+        """
+        if nprobe is not None and self.index_type in ("ivf_flat", "ivf_pq"):
+            return faiss.SearchParametersIVF(nprobe=int(nprobe))
+        if ef_search is not None and self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+        return None
+    
     def _save_index_and_df(self, base_path: str):
         """
         Save the FAISS index and DataFrame to disk.
@@ -203,15 +364,27 @@ class SemanticSearch:
         print(f"Saving FAISS index to {index_path}...")
         faiss.write_index(self.faiss_index, index_path)
         
+        meta_path = os.path.join(base_path, INDEX_META_FILE)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "index_type": self.index_type or "flat",
+                "params": self.index_params,
+                "dimension": self.embedding_dimension,
+                "ntotal": int(self.faiss_index.ntotal),
+            }, f, indent=2)
+        
         print("DataFrame and index saved successfully")
     
-    def search(self, query: str, k: int = 5) -> pd.DataFrame:
+    def search(self, query: str, k: int = 5, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> pd.DataFrame:
         """
         Поиск k наиболее похожих элементов на запрос.
         
         Args:
             query: Поисковый запрос
             k: Количество результатов для возврата
+            nprobe: Число просматриваемых списков IVF (для ivf_flat и ivf_pq)
+            ef_search: Размер списка кандидатов HNSW (для hnsw)
             
         Returns:
             DataFrame с результатами поиска и оценками сходства
@@ -224,35 +397,71 @@ class SemanticSearch:
         # Генерация эмбеддинга для запроса
         query_embedding = np.array([self.embedding_provider.get_embedding(query)]).astype('float32')
         
-        # Поиск похожих элементов
-        distances, indices = self.faiss_index.search(query_embedding, k)
-        
-        # Получение соответствующих строк из DataFrame
-        results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            if idx < len(self.df):  # Проверка валидности индекса
-                row = self.df.iloc[idx].to_dict()
-                row["similarity_score"] = float(distance)  # Добавление дистанции как оценки
-                results.append(row)
-        
-        # Создание DataFrame из результатов
-        results_df = pd.DataFrame(results)
-        
-        # Сортировка по сходству (меньше - лучше для L2 дистанции)
-        if not results_df.empty:
-            results_df = results_df.sort_values("similarity_score", ascending=True)
-        
-        return results_df
+        return self._search_vectors(query_embedding, k, nprobe, ef_search)[0]
     
-    def search_batch(self, queries: List[str], k: int = 5) -> List[pd.DataFrame]:
+    def search_batch(self, queries: Optional[List[str]] = None, k: int = 5,
+                     query_vectors: Optional[np.ndarray] = None, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None) -> List[pd.DataFrame]:
         """
         Search for multiple queries at once.
         
+        All queries are embedded with one provider batch call and searched with
+        a single FAISS call over the query matrix.
+        
         Args:
             queries: List of search queries
             k: Number of results to return for each query
+            query_vectors: Precomputed query embeddings of shape (n_queries, dimension), used instead of queries
+            nprobe: Number of IVF lists to visit (ivf_flat and ivf_pq indexes)
+            ef_search: Size of the HNSW candidate list (hnsw indexes)
             
         Returns:
             List of DataFrames containing the search results
         """
-        return [self.search(query, k) for query in queries]
+        if self.faiss_index is None or self.df is None:
+            raise ValueError("Index or DataFrame not loaded. Load or create one first.")
+        
+        if query_vectors is None:
+            if not queries:
+                return []
+            print(f"Batch search for {len(queries)} queries")
+            query_vectors = self.embedding_provider.get_batch_embeddings(list(queries))
+        
+        query_vectors = np.ascontiguousarray(query_vectors, dtype='float32')
+        if query_vectors.ndim == 1:
+            query_vectors = query_vectors.reshape(1, -1)
+        if query_vectors.ndim != 2 or query_vectors.shape[1] != self.faiss_index.d:
+            raise ValueError(f"Query vectors must have shape (n, {self.faiss_index.d}), got {query_vectors.shape}")
+        if len(query_vectors) == 0:
+            return []
+        
+        return self._search_vectors(query_vectors, k, nprobe, ef_search)
+    
+    def _search_vectors(self, query_vectors: np.ndarray, k: int, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None) -> List[pd.DataFrame]:
+        """
+        Run one FAISS search for a query matrix and gather the matching rows.
+        
+        Args:
+            query_vectors: Float32 matrix of query embeddings
+            k: Number of results per query
+            nprobe: Number of IVF lists to visit
+            ef_search: Size of the HNSW candidate list
+            
+        Returns:
+            One DataFrame per query, ordered by distance (lower is better for L2)
+        """
+        params = self._search_parameters(nprobe, ef_search)
+        if params is None:
+            distances, indices = self.faiss_index.search(query_vectors, k)
+        else:
+            distances, indices = self.faiss_index.search(query_vectors, k, params=params)
+        
+        # -1 means an approximate index found fewer than k neighbours
+        valid = (indices >= 0) & (indices < len(self.df))
+        rows = self.df.iloc[indices[valid]].reset_index(drop=True)
+        rows["similarity_score"] = distances[valid].astype(float)
+        
+        # FAISS returns each row of results already sorted by distance, so one gather can be split per query
+        bounds = np.concatenate(([0], np.cumsum(valid.sum(axis=1))))
+        return [rows.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True) for i in range(len(query_vectors))]
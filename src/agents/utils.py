@@ -4,13 +4,20 @@ Utility functions for the application
 """
 
 import json
-import requests
-import time
 from bs4 import BeautifulSoup
 import pandas as pd
 import os
 import logging
 from config import API_KEY
+from .http_client import get_http_client
+
+MWS_API_BASE_URL = "https://api.gpt.mws.ru/v1"
+
+def _mws_headers():
+    return {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json"
+    }
 
 def call_mws_gpt(messages, model="mws-gpt-alpha", temperature=0.65, retries=3):
     """
@@ -25,27 +32,42 @@ def call_mws_gpt(messages, model="mws-gpt-alpha", temperature=0.65, retries=3):
     Returns:
         str: Generated response
     """
-    url = "https://api.gpt.mws.ru/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature
     }
+    try:
+        data = get_http_client().post_json(f"{MWS_API_BASE_URL}/chat/completions", payload, _mws_headers(), retries=retries)
+        return data['choices'][0]['message']['content']
+    except Exception as e:
+        logging.error(f"Ошибка MWS GPT (чат) после {retries} попыток: {str(e)}")
+        raise
+
+async def acall_mws_gpt(messages, model="mws-gpt-alpha", temperature=0.65, retries=3):
+    """
+    Asynchronous function to call MWS GPT (chat)
+    
+    Args:
+        messages (list): List of message objects
+        model (str): Model name to use
+        temperature (float): Temperature for generation
+        retries (int): Number of retries
+        
+    Returns:
+        str: Generated response
+    """
     payload = {
         "model": model,
         "messages": messages,
         "temperature": temperature
     }
-    for attempt in range(retries):
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return data['choices'][0]['message']['content']
-        except Exception as e:
-            if attempt == retries - 1:
-                logging.error(f"Ошибка MWS GPT (чат) после {retries} попыток: {str(e)}")
-                raise
-            time.sleep(1)
+    try:
+        data = await get_http_client().apost_json(f"{MWS_API_BASE_URL}/chat/completions", payload, _mws_headers(), retries=retries)
+        return data['choices'][0]['message']['content']
+    except Exception as e:
+        logging.error(f"Ошибка MWS GPT (чат) после {retries} попыток: {str(e)}")
+        raise
 
 def get_mws_embeddings(texts, model="bge-m3", retries=3):
     """
@@ -59,26 +81,41 @@ def get_mws_embeddings(texts, model="bge-m3", retries=3):
     Returns:
         list: Embedding vector(s)
     """
-    url = "https://api.gpt.mws.ru/v1/embeddings"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
+    payload = {
+        "model": model,
+        "input": texts if isinstance(texts, list) else [texts]
     }
+    try:
+        data = get_http_client().post_json(f"{MWS_API_BASE_URL}/embeddings", payload, _mws_headers(), retries=retries,
+                                           retry_read_timeouts=True) # Эмбеддинги идемпотентны
+        return [item['embedding'] for item in data['data']] if isinstance(texts, list) else data['data'][0]['embedding']
+    except Exception as e:
+        logging.error(f"Ошибка MWS GPT (эмбеддинги) после {retries} попыток: {str(e)}")
+        raise
+
+async def aget_mws_embeddings(texts, model="bge-m3", retries=3):
+    """
+    Asynchronous function to get embeddings from MWS GPT
+    
+    Args:
+        texts (str or list): Text or list of texts to embed
+        model (str): Model name to use
+        retries (int): Number of retries
+        
+    Returns:
+        list: Embedding vector(s)
+    """
     payload = {
         "model": model,
         "input": texts if isinstance(texts, list) else [texts]
     }
-    for attempt in range(retries):
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return [item['embedding'] for item in data['data']] if isinstance(texts, list) else data['data'][0]['embedding']
-        except Exception as e:
-            if attempt == retries - 1:
-                logging.error(f"Ошибка MWS GPT (эмбеддинги) после {retries} попыток: {str(e)}")
-                raise
-            time.sleep(1)
+    try:
+        data = await get_http_client().apost_json(f"{MWS_API_BASE_URL}/embeddings", payload, _mws_headers(), retries=retries,
+                                                  retry_read_timeouts=True) # Эмбеддинги идемпотентны
+        return [item['embedding'] for item in data['data']] if isinstance(texts, list) else data['data'][0]['embedding']
+    except Exception as e:
+        logging.error(f"Ошибка MWS GPT (эмбеддинги) после {retries} попыток: {str(e)}")
+        raise
 
 def clean_html_content(html_content):
     """
@@ -18,6 +18,7 @@ import logging
 from crewai import Crew, Task
 # Import SemanticSearch from its new location within agents
 from agents.semantic_search import SemanticSearch, APIEmbeddingProvider # Assuming API provider usage
+from config import DEFAULT_EMBEDDING_CACHE_DIR
 # Import all necessary agent classes
 from agents import (
     KnowledgeExpertAgent, IntentRecognizerAgent, EmotionAnalyzerAgent,
@@ -53,7 +54,7 @@ def ask_all_agents():
     # --- 1. Initialize SemanticSearch --- (Keep as is)
     try:
         print("Инициализация SemanticSearch...")
-        semantic_search_engine = SemanticSearch.with_api_provider(api_key=API_KEY)
+        semantic_search_engine = SemanticSearch.with_api_provider(api_key=API_KEY, cache_dir=DEFAULT_EMBEDDING_CACHE_DIR)
         print("Загрузка индекса SemanticSearch...")
         semantic_search_engine.load_index(
             df_path="data/faiss_index/corpus.csv",
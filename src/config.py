@@ -25,4 +25,16 @@ warnings.filterwarnings("ignore", category=RuntimeWarning, module="bs4")
 DEFAULT_INDEX_PATH = "faiss_index.bin"
 DEFAULT_KNOWLEDGE_BASE_PATH = "knowledge_base_with_b2c.csv"
 DEFAULT_PROCESSED_JSON_PATH = "data/processed_articles.json"
-DEFAULT_FAISS_INDEX_DIR = "./data/faiss_index"
\ No newline at end of file
+DEFAULT_FAISS_INDEX_DIR = "./data/faiss_index"
+
+# HTTP transport for MWS GPT (chat and embeddings)
+HTTP_POOL_SIZE = 16  # Keep-alive connections per host
+HTTP_MAX_CONCURRENCY = 8  # Requests in flight across all agents and providers
+HTTP_CONNECT_TIMEOUT = 5.0  # Seconds
+HTTP_READ_TIMEOUT = 120.0  # Seconds; chat completions can be slow
+HTTP_RETRIES = 3  # Attempts per request for connection errors, timeouts, 429 and 5xx
+HTTP_BACKOFF_BASE = 0.5  # Seconds before the second attempt, doubled on each retry
+HTTP_BACKOFF_MAX = 10.0  # Upper bound for a single backoff delay
+
+# Persistent embedding cache (see semantic_search.CachedEmbeddingProvider)
+DEFAULT_EMBEDDING_CACHE_DIR = "./data/embedding_cache"
@@ -0,0 +1,187 @@
+import faster_whisper
+import ctranslate2
+import decoder as dc
+import warmup as wp
+import config as cfg
+import concurrent.futures
+import platform
+import argparse
+import datetime
+import hashlib
+import logging
+import psutil
+import json
+import time
+import os
+
+# Подбор compute_type и разбиения ядер между потоками CTranslate2 (cpu_threads) и его параллельными
+# обработчиками (num_workers) на конкретной машине. Число потоков декодирования (DECODE_WORKERS)
+# задаёт оператор: от него зависит порядок реплик, поэтому замер идёт при текущем значении.
+# Замер идёт на аудио прогрева тем же пакетным путём, что и живые сегменты; лучший вариант
+# сохраняется в кэш по ключу хоста и модели, и следующие запуски применяют его без повторного замера.
+
+TUNED_KEYS = ("COMPUTE_TYPE", "CPU_THREADS", "NUM_WORKERS")
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def host_key():
+    # Всё, от чего зависит лучший вариант: процессор, число ядер, модель, версия CTranslate2 и нагрузка
+    fields = dict(
+        cpu=_cpu_model(),
+        machine=platform.machine(),
+        physical_cores=psutil.cpu_count(logical=False),
+        logical_cores=psutil.cpu_count(),
+        model=cfg.MODEL_SIZE,
+        ctranslate2=ctranslate2.__version__,
+        batch_size=cfg.DECODE_BATCH_SIZE,
+        decode_workers=cfg.DECODE_WORKERS,
+        version=cfg.AUTOTUNE_CACHE_VERSION)
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{platform.node()}-{cfg.MODEL_SIZE}-{digest}", fields
+
+def _read_cache():
+    try:
+        with open(cfg.AUTOTUNE_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Autotune: не удалось прочитать кэш '{cfg.AUTOTUNE_CACHE_PATH}': {e}.")
+        return {}
+
+def _write_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(cfg.AUTOTUNE_CACHE_PATH) or ".", exist_ok=True)
+        tmp_path = cfg.AUTOTUNE_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cfg.AUTOTUNE_CACHE_PATH) # Атомарно, как кэш прогрева
+    except OSError as e:
+        logging.warning(f"Autotune: не удалось сохранить кэш '{cfg.AUTOTUNE_CACHE_PATH}': {e}.")
+
+def load_cached():
+    key, _ = host_key()
+    return _read_cache().get(key)
+
+def candidates():
+    supported = ctranslate2.get_supported_compute_types("cpu")
+    compute_types = [t for t in cfg.AUTOTUNE_COMPUTE_TYPES if t in supported]
+    cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+
+    splits = []
+    for workers in cfg.AUTOTUNE_WORKER_COUNTS:
+        threads = cores // workers
+        if threads >= 1 and (threads, workers) not in splits:
+            splits.append((threads, workers))
+
+    return [dict(COMPUTE_TYPE=compute_type, CPU_THREADS=threads, NUM_WORKERS=workers)
+            for compute_type in compute_types for threads, workers in splits]
+
+def measure(candidate, audio):
+    # Пропускная способность: секунд аудио, декодированных за секунду, при cfg.DECODE_WORKERS
+    # параллельных пакетах по DECODE_BATCH_SIZE сегментов
+    load_start = time.perf_counter()
+    model = faster_whisper.WhisperModel(
+        cfg.MODEL_SIZE,
+        device="cpu",
+        compute_type=candidate["COMPUTE_TYPE"],
+        cpu_threads=candidate["CPU_THREADS"],
+        num_workers=candidate["NUM_WORKERS"])
+    decoder = dc.BatchDecoder(model)
+    load_sec = time.perf_counter() - load_start
+
+    segment = audio[:decoder.max_samples]
+    batch = [segment] * cfg.DECODE_BATCH_SIZE
+    profile = cfg.DECODE_PROFILES[cfg.DECODE_DEFAULT_PROFILE]
+    workers = cfg.DECODE_WORKERS
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: decoder.decode(batch, **profile), range(workers))) # Прогрев, не в замере
+
+        timings = []
+        for _ in range(cfg.AUTOTUNE_RUNS):
+            run_start = time.perf_counter()
+            list(executor.map(lambda _: decoder.decode(batch, **profile), range(workers)))
+            timings.append(time.perf_counter() - run_start)
+
+    audio_sec = len(segment) * len(batch) * workers / cfg.SAMPLE_RATE
+    best = min(timings)
+    del decoder, model
+    return dict(candidate, throughput=audio_sec / best, rtf=best / audio_sec, load_sec=load_sec)
+
+def calibrate(save=True):
+    audio = wp.load_warmup_audio()
+    results = []
+    for candidate in candidates():
+        logging.info(f"Autotune: замер {candidate}...")
+        try:
+            result = measure(candidate, audio)
+        except Exception as e:
+            logging.warning(f"Autotune: вариант {candidate} не удался: {e}")
+            continue
+        logging.info(f"Autotune: {result['throughput']:.2f} с аудио/с (RTF {result['rtf']:.3f}).")
+        results.append(result)
+
+    if not results:
+        raise RuntimeError("Autotune: ни один вариант не удалось замерить.")
+
+    best = max(results, key=lambda r: r["throughput"])
+    key, fields = host_key()
+    entry = {
+        "config": {name: best[name] for name in TUNED_KEYS},
+        "throughput": best["throughput"],
+        "host": fields,
+        "measured_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "candidates": results,
+    }
+    if save:
+        cache = _read_cache()
+        cache[key] = entry
+        _write_cache(cache)
+    return entry
+
+def apply(entry):
+    for name, value in entry["config"].items():
+        setattr(cfg, name, value)
+    logging.info(f"Autotune: применены настройки {entry['config']} (замер {entry['measured_at']}).")
+
+def tune(mode=None):
+    # Вызывается из STTEngine.load() до загрузки моделей. mode (cfg.AUTOTUNE):
+    # "off" - ничего не делать, "cache" - применить сохранённый результат, если он есть,
+    # "startup" - при отсутствии результата откалибровать сейчас (долго: модель загружается для каждого варианта)
+    mode = mode or cfg.AUTOTUNE
+    if mode == "off":
+        return None
+
+    entry = load_cached()
+    if entry is None and mode == "startup":
+        logging.warning("Autotune: для этой машины нет сохранённых настроек, выполняется калибровка...")
+        entry = calibrate()
+    if entry is not None:
+        apply(entry)
+    return entry
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор COMPUTE_TYPE и числа потоков Whisper для этой машины.")
+    parser.add_argument("--dry-run", action="store_true", help="Не сохранять результат в кэш")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    entry = calibrate(save=not args.dry_run)
+    for result in sorted(entry["candidates"], key=lambda r: -r["throughput"]):
+        print(f"{result['COMPUTE_TYPE']:>14} threads={result['CPU_THREADS']:<3} workers={result['NUM_WORKERS']:<2} "
+              f"{result['throughput']:8.2f} с аудио/с  RTF {result['rtf']:.3f}")
+    print(f"Лучший вариант: {entry['config']}" + ("" if args.dry_run else f" (сохранён в '{cfg.AUTOTUNE_CACHE_PATH}')"))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
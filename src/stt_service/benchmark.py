@@ -0,0 +1,264 @@
+from stt_publisher import STTPublisher
+import file_transcriber as ft
+import soundfile as sf
+import resampler as rs
+import metrics as mt
+import whisper as wr
+import config as cfg
+import numpy as np
+import concurrent.futures
+import threading
+import platform
+import argparse
+import datetime
+import logging
+import psutil
+import bisect
+import json
+import time
+import os
+import re
+
+# Воспроизводимый замер STT: аудиофайлы подаются в сессии движка так же, как звонки в ingest_server,
+# в реальном времени (--speeds 1) и без ограничения скорости (--speeds 0). Результат - JSON,
+# чтобы сравнивать прогоны с разными MODEL_SIZE / COMPUTE_TYPE / потоками.
+
+CONFIG_KEYS = ("MODEL_SIZE", "COMPUTE_TYPE", "DEVICE", "CPU_THREADS", "NUM_WORKERS", "LANGUAGE",
+               "DECODE_WORKERS", "DECODE_BATCH_SIZE", "DECODE_BATCH_MAX_WAIT_SEC",
+               "DECODE_DEFAULT_PROFILE", "DECODE_ADAPTIVE", "PARTIALS_ENABLE", "VAD_PARAMETERS")
+
+def load_audio(path):
+    audio, sample_rate = sf.read(path, dtype='float32', always_2d=True)
+    return rs.resample(audio, sample_rate, cfg.SAMPLE_RATE)
+
+def load_reference(audio_path, references_dir=None):
+    # Эталон - одноимённый .txt рядом с аудио или в references_dir
+    name = os.path.splitext(os.path.basename(audio_path))[0] + ".txt"
+    for directory in filter(None, (references_dir, os.path.dirname(audio_path))):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+    return None
+
+def _words(text):
+    return re.findall(r"\w+", text.lower().replace("ё", "е"))
+
+def word_errors(reference, hypothesis):
+    # Расстояние Левенштейна по словам: (ошибок, слов в эталоне)
+    ref, hyp = _words(reference), _words(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1], len(ref)
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(values)), "count": len(values)}
+
+class ResourceSampler:
+    # CPU процесса (в долях всех ядер) и пиковый RSS за время прогона
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="BenchmarkSampler", daemon=True)
+
+    def __enter__(self):
+        self._cpu_start = self.process.cpu_times()
+        self._wall_start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        cpu = self.process.cpu_times()
+        self.cpu_seconds = (cpu.user - self._cpu_start.user) + (cpu.system - self._cpu_start.system)
+        self.wall_seconds = time.perf_counter() - self._wall_start
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def results(self):
+        cores = psutil.cpu_count() or 1
+        return {
+            "cpu_seconds": self.cpu_seconds,
+            "cpu_utilisation": self.cpu_seconds / max(self.wall_seconds, 1e-9) / cores, # 1.0 - заняты все ядра
+            "cpu_cores_used": self.cpu_seconds / max(self.wall_seconds, 1e-9),
+            "peak_rss_mb": self.peak_rss / 2**20,
+        }
+
+def replay_file(engine, path, speed, chunk_ms, references_dir=None):
+    # Подаёт файл в новую сессию блоками по chunk_ms. speed=1 - в реальном времени, 0 - так быстро,
+    # как успевает VAD (с тем же ограничением отставания, что в ingest_server)
+    audio = load_audio(path)
+    # Хвост тишины, чтобы VAD закрыл последнюю реплику
+    tail = int(cfg.SAMPLE_RATE * (cfg.VAD_PARAMETERS.get("min_silence_duration_ms", 1000) / 1000 + 1.0))
+    audio = np.concatenate([audio, np.zeros(tail, dtype=np.float32)])
+
+    utterances = []
+    def collect(batch):
+        utterances.extend(batch)
+
+    stream_id = f"bench-{os.path.basename(path)}-{speed:g}x"
+    publisher = STTPublisher(max_batch_size=1, engine=engine, stream_id=stream_id, use_microphone=False)
+    publisher.subscribe(collect)
+    publisher.start()
+    session = publisher.session
+    if session is None:
+        raise RuntimeError("Не удалось открыть сессию STT.")
+
+    chunk = int(cfg.SAMPLE_RATE * chunk_ms / 1000)
+    max_backlog = int(cfg.SAMPLE_RATE * cfg.INGEST_MAX_BACKLOG_SEC)
+    fed_positions, fed_times = [], [] # Когда каждый блок попал в сессию - для задержки от конца речи
+    base = session.ring_buffer.end
+    start_time = time.perf_counter()
+
+    for offset in range(0, len(audio), chunk):
+        if speed > 0:
+            delay = start_time + offset / cfg.SAMPLE_RATE / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            while session.ring_buffer.end - session.vad.position > max_backlog:
+                time.sleep(cfg.INGEST_BACKPRESSURE_POLL_SEC)
+        publisher.feed(audio[offset:offset + chunk])
+        fed_positions.append(base + min(offset + chunk, len(audio)))
+        fed_times.append(time.time())
+
+    # Ждём, пока VAD дочитает буфер, и останавливаем сессию: stop() дожидается потока VAD,
+    # поэтому после него все события уже разобраны и finals_submitted больше не растёт
+    while session.is_running and session.ring_buffer.end - session.vad.position >= session.vad.window_size:
+        time.sleep(0.01)
+    session.stop()
+    # Теперь ждём возврата из декодера всех поставленных финальных сегментов
+    while engine.is_running and session.finals_delivered + session.finals_dropped < session.finals_submitted:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start_time
+    publisher.stop()
+
+    latencies = []
+    for utterance in utterances:
+        # Задержка от момента, когда последний сэмпл речи попал в сессию, до публикации
+        index = min(bisect.bisect_left(fed_positions, utterance.end), len(fed_times) - 1)
+        latencies.append(max(0.0, utterance.published_at - fed_times[index]))
+
+    duration = (len(audio) - tail) / cfg.SAMPLE_RATE
+    result = {
+        "path": path,
+        "speed": speed,
+        "duration_sec": duration,
+        "elapsed_sec": elapsed,
+        "rtf": elapsed / max(duration, 1e-9),
+        "utterances": len(utterances),
+        "latencies": latencies,
+        "decode_latencies": [utterance.decode_latency for utterance in utterances],
+        "samples_lost": session.vad.samples_lost,
+        "vad_skip_ratio": session.vad.skip_ratio,
+    }
+
+    reference = load_reference(path, references_dir)
+    if reference is not None:
+        hypothesis = " ".join(utterance.text for utterance in utterances)
+        result["word_errors"], result["reference_words"] = word_errors(reference, hypothesis)
+    return result
+
+def run_benchmark(engine, paths, speed, chunk_ms=cfg.BLOCK_DURATION_MS, concurrency=1, references_dir=None):
+    with ResourceSampler() as sampler:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(replay_file, engine, path, speed, chunk_ms, references_dir) for path in paths]
+            files = []
+            for future in futures:
+                try:
+                    files.append(future.result())
+                except Exception as e:
+                    logging.error(f"Benchmark: ошибка при обработке файла: {e}")
+
+    duration = sum(f["duration_sec"] for f in files)
+    summary = {
+        "speed": speed,
+        "concurrency": concurrency,
+        "files": len(files),
+        "audio_sec": duration,
+        "wall_sec": sampler.wall_seconds,
+        "rtf": sampler.wall_seconds / max(duration, 1e-9) if duration else None,
+        "utterances": sum(f["utterances"] for f in files),
+        "latency_sec": percentiles([x for f in files for x in f.pop("latencies")]),
+        "decode_latency_sec": percentiles([x for f in files for x in f.pop("decode_latencies")]),
+        "samples_lost": sum(f["samples_lost"] for f in files),
+        **sampler.results(),
+    }
+
+    scored = [f for f in files if "word_errors" in f]
+    if scored:
+        summary["wer"] = sum(f["word_errors"] for f in scored) / max(sum(f["reference_words"] for f in scored), 1)
+        for f in scored:
+            f["wer"] = f["word_errors"] / max(f["reference_words"], 1)
+
+    summary["per_file"] = files
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер скорости и задержки STT на наборе аудиофайлов.")
+    parser.add_argument("inputs", nargs="+", help="Файлы или каталоги с аудио (любая частота, каналы сводятся в моно)")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1.0, 0.0], help="Скорости подачи (1 - реальное время, 0 - без ограничения)")
+    parser.add_argument("--chunk-ms", type=int, default=cfg.BLOCK_DURATION_MS, help="Размер подаваемого блока, мс")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Сколько файлов подавать одновременно (как параллельные звонки)")
+    parser.add_argument("-r", "--references", help="Каталог с эталонными транскриптами <имя>.txt (для WER)")
+    parser.add_argument("-o", "--output", help="Файл для JSON с результатами (по умолчанию - stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=cfg.LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    paths = ft.find_audio_files(args.inputs)
+    if not paths:
+        logging.error("Не найдено ни одного аудиофайла.")
+        return 1
+
+    load_start = time.perf_counter()
+    engine = wr.STTEngine()
+    if not engine.load():
+        logging.error("Не удалось загрузить модели.")
+        return 1
+    engine.ready.wait() # Прогрев не должен попадать в замер
+    engine.start()
+    load_sec = time.perf_counter() - load_start
+
+    runs = []
+    try:
+        for speed in args.speeds:
+            logging.info(f"Benchmark: прогон со скоростью {speed:g}x...")
+            runs.append(run_benchmark(engine, paths, speed, args.chunk_ms, args.concurrency, args.references))
+    finally:
+        engine.stop()
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": {"node": platform.node(), "machine": platform.machine(), "cpu_count": psutil.cpu_count(),
+                 "python": platform.python_version()},
+        "config": {key: getattr(cfg, key) for key in CONFIG_KEYS},
+        "load_sec": load_sec,
+        "startup_timings": engine.startup_timings,
+        "runs": runs,
+        "metrics": mt.snapshot(),
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import metrics as mt
+import collections
+import threading
+import weakref
+import queue
+import time
+
+BLOCK = "block" # Производитель ждёт освобождения места
+DROP_OLDEST = "drop_oldest" # Выбрасывается самый старый элемент
+DROP_NEWEST = "drop_newest" # Выбрасывается новый элемент
+COALESCE = "coalesce" # Новый элемент сливается с последним (coalesce(last, new)), иначе - как DROP_OLDEST
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+def trim_merged(merged, coalesce_max):
+    # Слитый элемент-список не растёт бесконечно: сверх coalesce_max отбрасываются самые старые записи.
+    # Возвращает (элемент, сколько записей отброшено)
+    if coalesce_max is None or not isinstance(merged, list) or len(merged) <= coalesce_max:
+        return merged, 0
+    excess = len(merged) - coalesce_max
+    return merged[excess:], excess
+
+_registry = weakref.WeakSet() # Все живые очереди - для отчёта о глубине
+
+# Потери считаются в момент отбрасывания: сумма по живым очередям уменьшалась бы при их удалении
+_DROPPED = mt.counter("stt_queue_dropped_total", "Элементов отброшено по политике переполнения", ("queue",))
+_COALESCED = mt.counter("stt_queue_coalesced_total", "Элементов слито с предыдущим", ("queue",))
+
+class BoundedQueue:
+    # Ограниченная потокобезопасная очередь с явной политикой переполнения и счётчиками.
+    # Интерфейс совместим с queue.Queue (put/get/put_nowait/get_nowait, queue.Full/queue.Empty).
+
+    def __init__(self, name, maxsize, policy=BLOCK, coalesce=None, coalesce_max=None, on_drop=None):
+        if maxsize <= 0:
+            raise ValueError(f"Очередь '{name}': размер должен быть положительным.")
+        if policy not in POLICIES:
+            raise ValueError(f"Очередь '{name}': неизвестная политика '{policy}', ожидается одна из {POLICIES}.")
+
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self._coalesce = coalesce # Функция (last, new) -> объединённый элемент или None, если слить нельзя
+        self.coalesce_max = coalesce_max # Максимальная длина слитого элемента-списка (None - без ограничения)
+        self._on_drop = on_drop # Вызывается (вне блокировки) для элемента, вытесненного из очереди по политике
+
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_watermark = 0 # Максимальная наблюдавшаяся глубина
+        self.closed = False # После close() и опустошения очереди get() возвращает None
+        self._dropped_total = _DROPPED.labels(name)
+        self._coalesced_total = _COALESCED.labels(name)
+
+        _registry.add(self)
+
+    def put(self, item, block=True, timeout=None):
+        # True - элемент в очереди (возможно, слит с предыдущим), False - отброшен по политике
+        evicted = []
+        try:
+            return self._put(item, block, timeout, evicted)
+        finally:
+            if self._on_drop is not None:
+                for dropped in evicted:
+                    self._on_drop(dropped)
+
+    def _put(self, item, block, timeout, evicted):
+        with self._not_full:
+            if len(self._items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    if not block:
+                        raise queue.Full
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    while len(self._items) >= self.maxsize:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise queue.Full
+                        self._not_full.wait(remaining)
+
+                elif self.policy == DROP_NEWEST:
+                    self._drop(1)
+                    return False
+
+                else:
+                    if self.policy == COALESCE and self._coalesce is not None:
+                        merged = self._coalesce(self._items[-1], item)
+                        if merged is not None:
+                            merged, trimmed = trim_merged(merged, self.coalesce_max)
+                            self._items[-1] = merged
+                            self._drop(trimmed) # Потерянные записи учитываются как отброшенные
+                            self.coalesced += 1
+                            self._coalesced_total.inc()
+                            self.put_count += 1
+                            return True
+                    evicted.append(self._items.popleft())
+                    self._drop(1)
+
+            self._append(item)
+            return True
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def close(self):
+        # Сигнал остановки читателям: флаг, а не элемент очереди, поэтому его нельзя вытеснить.
+        # Оставшиеся элементы ещё выдаются, затем каждый get() возвращает None
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+
+    def reopen(self):
+        # Повторный запуск читателей после close()
+        with self._lock:
+            self.closed = False
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if not block:
+                if not self._items and not self.closed:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._items and not self.closed:
+                    self._not_empty.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self._items and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+
+            if not self._items: # Очередь закрыта и пуста
+                return None
+
+            item = self._items.popleft()
+            self.get_count += 1
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return len(self._items) >= self.maxsize
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "policy": self.policy,
+                "maxsize": self.maxsize,
+                "depth": len(self._items),
+                "high_watermark": self.high_watermark,
+                "put": self.put_count,
+                "get": self.get_count,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+    def _drop(self, count):
+        if count:
+            self.dropped += count
+            self._dropped_total.inc(count)
+
+    def _append(self, item):
+        self._items.append(item)
+        self.put_count += 1
+        self.high_watermark = max(self.high_watermark, len(self._items))
+        self._not_empty.notify()
+
+def all_stats():
+    return [q.stats() for q in list(_registry)]
+
+def _collect_metrics():
+    # Очереди с одинаковым именем (например, очереди подписчиков разных звонков) суммируются
+    totals = {}
+    for s in all_stats():
+        total = totals.setdefault(s["name"], dict(depth=0, high_watermark=0))
+        total["depth"] += s["depth"]
+        total["high_watermark"] = max(total["high_watermark"], s["high_watermark"])
+
+    def samples(key):
+        return [({"queue": name}, total[key]) for name, total in totals.items()]
+    return [
+        ("stt_queue_depth", "gauge", "Текущая глубина очереди", samples("depth")),
+        ("stt_queue_high_watermark", "gauge", "Максимальная глубина очереди", samples("high_watermark")),
+    ]
+
+mt.register_collector(_collect_metrics)
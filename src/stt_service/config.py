@@ -9,6 +9,7 @@ SAMPLE_RATE = 16000
 BLOCK_DURATION_MS = 100 # Длительность блока аудио для обработки (в миллисекундах)
 BLOCK_SIZE = int(SAMPLE_RATE * BLOCK_DURATION_MS / 1000) # Размер блока в сэмплах
 CHANNELS = 1 # Моно 
+RING_BUFFER_SEC = 60 # Ёмкость кольцевого буфера аудио (в секундах)
 
 # whisper
 MODEL_SIZE = "small"  # "tiny", "base", "small", "medium", "large-v1", "large-v2", "large-v3"
@@ -17,17 +18,93 @@ DEVICE = "auto" # cpu, cuda, auto
 COMPUTE_TYPE = "auto" # int8, float32, auto
 CPU_THREADS = 6
 NUM_WORKERS = 6
+# Подбор COMPUTE_TYPE, CPU_THREADS и NUM_WORKERS под процессор при текущем DECODE_WORKERS (autotune.py, только CPU):
+# off - как указано выше, cache - применить сохранённый замер для этой машины и модели,
+# startup - если замера нет, выполнить его при запуске (модель загружается для каждого варианта)
+AUTOTUNE = "cache"
+AUTOTUNE_CACHE_PATH = ".cache/autotune.json"
+AUTOTUNE_CACHE_VERSION = 2 # Увеличить при изменении способа замера
+AUTOTUNE_COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+AUTOTUNE_WORKER_COUNTS = (1, 2, 3, 4) # Варианты NUM_WORKERS (ядра делятся между обработчиками CTranslate2 поровну)
+AUTOTUNE_RUNS = 3 # Замеров на вариант (берётся лучший)
+DECODE_WORKERS = 1 # Потоки декодирования сегментов (при нескольких порядок реплик не гарантируется)
+DECODE_BATCH_SIZE = 8 # Максимум сегментов, декодируемых одним пакетным вызовом
+DECODE_BATCH_MAX_WAIT_SEC = 0.02 # Сколько ждать добора пакета после первого готового сегмента
+
+# decode profiles
+DECODE_PROFILES = {
+    "fast": dict(beam_size=1, best_of=1, temperatures=(0.0,)),
+    "balanced": dict(beam_size=3, best_of=3, temperatures=(0.0, 0.4, 0.8)),
+    "accurate": dict(beam_size=5, best_of=5, temperatures=(0.0, 0.2, 0.4, 0.6, 0.8, 1.0)),
+}
+DECODE_PROFILE_ORDER = ("accurate", "balanced", "fast") # От самого точного к самому дешёвому
+DECODE_DEFAULT_PROFILE = "accurate"
+DECODE_ADAPTIVE = True # Переключать профиль по нагрузке
+DECODE_LATENCY_SLO_SEC = 3.0 # Целевая задержка от конца реплики до публикации
+DECODE_SLO_RISK_RATIO = 0.5 # SLO под угрозой, если сегмент прождал в очереди больше этой доли SLO
+DECODE_DOWNGRADE_QUEUE_DEPTH = 4 # ...или если в очереди осталось столько сегментов
+DECODE_PROFILE_HOLD_SEC = 10 # Минимальная пауза перед возвратом к более точному профилю
+DECODE_WORD_TIMESTAMPS = False # Времена слов в Utterance.words (последовательное декодирование с выравниванием - дороже)
+
+# queues: размер и политика переполнения каждой очереди на пути STT
+# block - производитель ждёт, drop_oldest / drop_newest - отбросить старый / новый элемент,
+# coalesce - слить с последним элементом (пакеты реплик, промежуточные гипотезы), иначе как drop_oldest
+QUEUE_LIMITS = {
+    "decode": dict(maxsize=16, policy="block"), # Сегменты, ожидающие декодирования (при block ждёт VAD, аудио копится в кольцевом буфере)
+    # Очередь каждого подписчика STTPublisher (реплики, гипотезы). coalesce_max - сколько реплик может накопиться
+    # в одном слитом пакете у переполненной очереди; сверх этого старые реплики отбрасываются (учитываются в dropped)
+    "subscriber": dict(maxsize=256, policy="coalesce", coalesce_max=64),
+    "ingest_send": dict(maxsize=100, policy="drop_oldest"), # Подписчики WebSocket в ingest_server (asyncio: только drop_* / coalesce)
+}
+
+# metrics (metrics.py)
+# Гистограммы задержек стадий, счётчики и глубины очередей собираются всегда (metrics.snapshot())
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108 # HTTP /metrics в формате Prometheus (0 - не открывать; у ingest_server есть свой /metrics)
+
+# utterance history (history.py)
+HISTORY_MEMORY_ITEMS = 1000 # Реплик в памяти, более старые вытесняются на диск
+HISTORY_PAGE_SIZE = 200 # Реплик в одной странице истории
+HISTORY_DIR = ".cache/history" # Файлы-сегменты вытесненной истории
+HISTORY_KEEP_FILES = False # Оставлять файлы истории после остановки издателя
+
+# partial (interim) transcripts
+PARTIALS_ENABLE = False # Публиковать промежуточные гипотезы до конца реплики (см. STTPublisher.subscribe_partials)
+PARTIAL_INTERVAL_SEC = 1.0 # Как часто передекодировать открытую реплику
+PARTIAL_WINDOW_SEC = 8 # Декодируется только хвост реплики такой длины
+PARTIAL_PROFILE = "fast" # Жадное декодирование для промежуточных гипотез
+
+# offline transcription (file_transcriber.py)
+FILE_CHUNK_SEC = 10 # Размер блока, которым читается файл (должен быть заметно меньше RING_BUFFER_SEC)
+FILE_WORKERS = 0 # Число процессов, 0 - по числу ядер / FILE_CPU_THREADS_PER_WORKER
+FILE_CPU_THREADS_PER_WORKER = 2 # Потоков Whisper в каждом процессе
+
+# ingest server (ingest_server.py)
+INGEST_HOST = "127.0.0.1"
+INGEST_PORT = 8765
+INGEST_MAX_BACKLOG_SEC = 5 # Если VAD звонка отстал больше, сервер перестаёт читать сокет
+INGEST_BACKPRESSURE_POLL_SEC = 0.05 # Как часто проверять, догнал ли VAD
+INGEST_MIN_SAMPLE_RATE = 8000 # Допустимые частоты входа (передискретизация к SAMPLE_RATE)
+INGEST_MAX_SAMPLE_RATE = 48000
+INGEST_MAX_CHANNELS = 2 # Каналы сводятся в моно
 
 # silero VAD
 SILERO_VAD_MODEL = 'silero_vad' # Модель для обработки тишины и шума в потоке
 SILERO_VAD_REPO = 'snakers4/silero-vad'
-VAD_PROCESS_INTERVAL_SEC = 0.01 # Интервал, через который проверяем буфер с помощью VAD
 VAD_PARAMETERS = dict(min_silence_duration_ms=1000, threshold=0.8)
 # threshold: Порог вероятности (чем выше, тем строже VAD)
 # min_silence_duration_ms: Минимальная длительность тишины для разделения сегментов 
+# Энергетический фильтр перед Silero: окна не громче уровня шума + VAD_GATE_MARGIN_DB не отправляются в нейросеть
+VAD_GATE_ENABLE = True
+VAD_GATE_MARGIN_DB = 6.0 # Запас над уровнем шума; окна громче всегда проверяет Silero
+VAD_GATE_FLOOR_RISE = 0.01 # Скорость подъёма уровня шума за окно (~3 с до нового фона при 32 мс окнах)
+VAD_GATE_FLOOR_FALL = 0.5 # Скорость опускания уровня шума за окно
+VAD_GATE_MIN_DB = -90.0 # Нижняя граница энергии (цифровая тишина)
+VAD_MAX_SEGMENT_SEC = 28 # Более длинная речь режется на сегменты (окно Whisper - 30 с, должно быть меньше RING_BUFFER_SEC)
 
 # silero TTS & warming up models
 WARMUP_ENABLE = True
+WARMUP_IN_BACKGROUND = True # Принимать аудио сразу после загрузки моделей, прогреваясь в фоне
 NUM_WARMUP_RUNS = 3
 TTS_NUM_SPEAKERS = 3
 TTS_SILERO_MODEL = 'silero_tts' 
@@ -35,4 +112,6 @@ TTS_SILERO_REPO = 'snakers4/silero-models'
 TTS_SPEAKER = "random" # см. документацию по silero  
 TTS_SAMPLE_RATE = 8000
 TTS_MODEL_VERSION = "v4_ru"   
+WARMUP_CACHE_DIR = ".cache/warmup" # Кэш синтезированного аудио для прогрева (TTS загружается только при промахе)
+WARMUP_CACHE_VERSION = 1 # Увеличить при изменении способа генерации аудио
 TTS_WARMUP_TEXT = "Это текст для прогрева моделей? Невероятно! Это действительно текст для прогрева моделей."
\ No newline at end of file
@@ -0,0 +1,219 @@
+from faster_whisper.tokenizer import Tokenizer
+from typing import NamedTuple
+import metrics as mt
+import config as cfg
+import numpy as np
+import threading
+import logging
+import time
+import zlib
+
+_PROFILE_SWITCHES = mt.counter("stt_decode_profile_switches_total", "Переключений профиля декодирования", ("from_profile", "to_profile"))
+_PROFILE_ACTIVE = mt.gauge("stt_decode_profile_active", "Текущий профиль декодирования финальных сегментов (1 - активен)", ("profile",))
+
+class DecodeResult(NamedTuple):
+    text: str
+    avg_logprob: float
+    no_speech_prob: float
+    segments: tuple = () # (start, end, text) в секундах от начала аудио
+    words: tuple = () # (start, end, word, probability) - только при word_timestamps
+
+def compression_ratio(text):
+    text_bytes = text.encode("utf-8")
+    return len(text_bytes) / len(zlib.compress(text_bytes))
+
+class BatchDecoder:
+    # Пакетное декодирование: сегменты (каждый не длиннее окна Whisper в 30 с) кодируются
+    # и декодируются одним вызовом CTranslate2, чтобы модель видела сразу несколько последовательностей.
+
+    NO_SPEECH_THRESHOLD = 0.6 # Те же пороги, что в faster_whisper.transcribe
+    LOG_PROB_THRESHOLD = -1.0
+    COMPRESSION_RATIO_THRESHOLD = 2.4
+
+    def __init__(self, whisper_model, language=cfg.LANGUAGE):
+        self.whisper_model = whisper_model
+        self.language = language
+        self.tokenizer = Tokenizer(
+            whisper_model.hf_tokenizer,
+            whisper_model.model.is_multilingual,
+            task="transcribe",
+            language=language)
+        self.prompt = whisper_model.get_prompt(self.tokenizer, [], without_timestamps=True)
+        self.max_length = getattr(whisper_model, "max_length", 448)
+
+        feature_extractor = whisper_model.feature_extractor
+        self.n_frames = feature_extractor.nb_max_frames # Кадров в окне 30 с
+        self.max_samples = feature_extractor.n_samples # Сэмплов в окне 30 с
+
+    def decode(self, audios, beam_size=5, best_of=5, temperatures=(0.0,), word_timestamps=False):
+        results = [None] * len(audios)
+        batch_indices = []
+
+        for i, audio in enumerate(audios):
+            # Не помещается в одно окно или нужны времена слов (выравнивание есть только
+            # в faster_whisper.transcribe) - обычный последовательный путь
+            if len(audio) > self.max_samples or word_timestamps:
+                results[i] = self._decode_sequential(audio, beam_size, best_of, temperatures, word_timestamps)
+            else:
+                batch_indices.append(i)
+
+        if batch_indices:
+            batch_results = self._decode_batch([audios[i] for i in batch_indices], beam_size, best_of, temperatures)
+            for i, result in zip(batch_indices, batch_results):
+                # Без временных меток Whisper сегмент один - всё аудио
+                if result.text:
+                    result = result._replace(segments=((0.0, len(audios[i]) / cfg.SAMPLE_RATE, result.text),))
+                results[i] = result
+
+        return results
+
+    def _features(self, audio):
+        features = self.whisper_model.feature_extractor(audio)
+        frames = features.shape[-1]
+        if frames >= self.n_frames:
+            return features[:, :self.n_frames]
+        return np.pad(features, ((0, 0), (0, self.n_frames - frames)))
+
+    def _generate(self, features, beam_size, best_of, temperature):
+        encoder_output = self.whisper_model.encode(features)
+
+        if temperature > 0: # Сэмплирование: best_of гипотез при заданной температуре
+            options = dict(beam_size=1, num_hypotheses=best_of, sampling_topk=0, sampling_temperature=temperature)
+        else:
+            options = dict(beam_size=beam_size)
+
+        outputs = self.whisper_model.model.generate(
+            encoder_output,
+            [self.prompt] * len(features),
+            max_length=self.max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+            **options)
+
+        results = []
+        for output in outputs:
+            tokens = output.sequences_ids[0]
+            avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1) # Как в faster_whisper (length_penalty=1)
+            text = self.tokenizer.decode(tokens).strip()
+            results.append(DecodeResult(text, avg_logprob, output.no_speech_prob))
+        return results
+
+    def _needs_fallback(self, result):
+        if result.no_speech_prob > self.NO_SPEECH_THRESHOLD: # Тишина - повторять с другой температурой незачем
+            return False
+        return (result.avg_logprob < self.LOG_PROB_THRESHOLD
+                or compression_ratio(result.text) > self.COMPRESSION_RATIO_THRESHOLD)
+
+    def _decode_batch(self, audios, beam_size, best_of, temperatures):
+        features = np.stack([self._features(audio) for audio in audios]).astype(np.float32)
+
+        # Температурный fallback как в faster_whisper: при повторе декодируются только неудачные сегменты
+        best = [None] * len(audios)
+        pending = list(range(len(audios)))
+        for temperature in temperatures:
+            outputs = self._generate(features[pending], beam_size, best_of, temperature)
+            retry = []
+            for i, result in zip(pending, outputs):
+                if best[i] is None or result.avg_logprob > best[i].avg_logprob:
+                    best[i] = result
+                if self._needs_fallback(result):
+                    retry.append(i)
+            pending = retry
+            if not pending:
+                break
+
+        results = []
+        for result in best:
+            # Тишину/шум, распознанные Whisper как "нет речи", отбрасываем
+            if result.no_speech_prob > self.NO_SPEECH_THRESHOLD and result.avg_logprob < self.LOG_PROB_THRESHOLD:
+                result = result._replace(text="")
+            results.append(result)
+        return results
+
+    def _decode_sequential(self, audio, beam_size, best_of, temperatures, word_timestamps=False):
+        try:
+            segments, info = self.whisper_model.transcribe(
+                audio,
+                language=self.language,
+                beam_size=beam_size,
+                best_of=best_of,
+                temperature=list(temperatures),
+                task="transcribe",
+                word_timestamps=word_timestamps,
+                vad_filter=False)
+            segments = list(segments)
+        except Exception as e:
+            logging.warning(f"Ошибка при транскрипции сегмента Whisper: {e}")
+            return DecodeResult("", 0.0, 0.0)
+
+        text = " ".join(s.text.strip() for s in segments).strip()
+        avg_logprob = float(np.mean([s.avg_logprob for s in segments])) if segments else 0.0
+        no_speech_prob = float(np.mean([s.no_speech_prob for s in segments])) if segments else 0.0
+        return DecodeResult(
+            text, avg_logprob, no_speech_prob,
+            segments=tuple((s.start, s.end, s.text.strip()) for s in segments),
+            words=tuple((w.start, w.end, w.word.strip(), w.probability) for s in segments for w in (s.words or ())))
+
+class DecodeProfileController:
+    # Выбор профиля декодирования по нагрузке: если SLO задержки под угрозой (сегменты долго ждут
+    # в очереди или очередь растёт), переходим на более дешёвый профиль, а когда очередь разобрана -
+    # возвращаемся к более точному, но не чаще раза в DECODE_PROFILE_HOLD_SEC.
+
+    def __init__(self, profiles=cfg.DECODE_PROFILES, order=cfg.DECODE_PROFILE_ORDER,
+                 initial=cfg.DECODE_DEFAULT_PROFILE, adaptive=cfg.DECODE_ADAPTIVE):
+        self.profiles = profiles
+        self.order = list(order) # От самого точного к самому дешёвому
+        self.base_index = self.order.index(initial)
+        self.index = self.base_index
+        self.adaptive = adaptive
+
+        self.switch_counts = {} # (из профиля, в профиль) -> число переключений
+        for name in self.order:
+            _PROFILE_ACTIVE.labels(name).set(1 if name == self.name else 0)
+        self._last_switch = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.order[self.index]
+
+    @property
+    def profile(self):
+        return self.profiles[self.name]
+
+    def update(self, queue_depth, oldest_age):
+        if not self.adaptive:
+            return self.name
+
+        with self._lock:
+            now = time.monotonic()
+            at_risk = (oldest_age > cfg.DECODE_LATENCY_SLO_SEC * cfg.DECODE_SLO_RISK_RATIO
+                       or queue_depth >= cfg.DECODE_DOWNGRADE_QUEUE_DEPTH)
+            caught_up = queue_depth == 0 and oldest_age < cfg.DECODE_LATENCY_SLO_SEC * cfg.DECODE_SLO_RISK_RATIO / 2
+
+            if at_risk and self.index < len(self.order) - 1:
+                self._switch(self.index + 1, now, queue_depth, oldest_age)
+            elif caught_up and self.index > self.base_index and now - self._last_switch >= cfg.DECODE_PROFILE_HOLD_SEC:
+                self._switch(self.index - 1, now, queue_depth, oldest_age)
+
+            return self.name
+
+    def _switch(self, index, now, queue_depth, oldest_age):
+        key = (self.order[self.index], self.order[index])
+        self.switch_counts[key] = self.switch_counts.get(key, 0) + 1
+        _PROFILE_SWITCHES.labels(*key).inc()
+        _PROFILE_ACTIVE.labels(key[0]).set(0)
+        _PROFILE_ACTIVE.labels(key[1]).set(1)
+        logging.info(f"Декодирование: профиль '{key[0]}' -> '{key[1]}' "
+                     f"(очередь: {queue_depth}, возраст сегмента: {oldest_age:.2f} с).")
+        self.index = index
+        self._last_switch = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                "profile": self.name,
+                "switches": {f"{src}->{dst}": count for (src, dst), count in self.switch_counts.items()},
+            }
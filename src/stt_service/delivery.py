@@ -0,0 +1,300 @@
+from typing import NamedTuple
+import bounded_queue as bq
+import metrics as mt
+import utterance as ut
+import config as cfg
+import concurrent.futures
+import collections
+import threading
+import logging
+import asyncio
+import inspect
+import queue
+import time
+
+# Доставка реплик подписчикам: у каждого подписчика своя очередь и свой исполнитель
+# (поток или задача asyncio), поэтому медленный подписчик не задерживает остальных.
+# Элементы очереди: список реплик (utterance.Utterance), TranscriptUpdate или HistoryRequest.
+
+_DISPATCH = mt.histogram("stt_stage_seconds", "Длительность стадий STT", ("stage",)).labels("dispatch")
+_CALLBACK = mt.histogram("stt_stage_seconds", "Длительность стадий STT", ("stage",)).labels("callback")
+_ASYNC_DROPPED = mt.counter("stt_subscriber_dropped_total", "Элементов, отброшенных очередью подписчика asyncio")
+
+def _observe_dispatch(item):
+    # От публикации реплики до начала вызова колбека подписчика (ожидание в очереди и пакетирование)
+    if type(item) is list and item and hasattr(item[0], "published_at"):
+        _DISPATCH.observe(max(0.0, time.time() - item[0].published_at))
+
+class HistoryRequest(NamedTuple):
+    # Запрос истории для одного подписчика: страницы читаются уже в его потоке/задаче
+    # и доставляются по порядку с пакетами реплик
+    history: object # history.UtteranceHistory
+    offset: int = 0
+    start_time: float = None
+    end_time: float = None
+
+    def pages(self):
+        for entries in self.history.pages(self.offset, self.start_time, self.end_time):
+            yield [entry.utterance for entry in entries]
+
+def callback_name(callback):
+    return callback.__name__ if hasattr(callback, '__name__') else 'callback'
+
+def coalesce_items(last, new):
+    # Пакеты реплик склеиваются, устаревшая промежуточная гипотеза заменяется новой
+    if type(last) is list and type(new) is list:
+        return last + new
+    if (isinstance(last, ut.TranscriptUpdate) and isinstance(new, ut.TranscriptUpdate)
+            and not last.is_final and (last.stream_id, last.utterance_id) == (new.stream_id, new.utterance_id)):
+        return new
+    return None
+
+class Batcher:
+    # Правило пакетирования подписчика: пакет отдаётся, когда набралось batch_size реплик
+    # или когда первая реплика пакета ждёт дольше max_latency секунд (что наступит раньше)
+
+    def __init__(self, batch_size=None, max_latency=None):
+        if batch_size is None and max_latency is None:
+            raise ValueError("Нужно задать batch_size, max_latency или оба.")
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.first_at = None # Когда в пакет попала первая реплика
+
+    def add(self, utterances, now):
+        if not self.pending:
+            self.first_at = now
+        self.pending.extend(utterances)
+
+        ready = []
+        if self.batch_size:
+            while len(self.pending) >= self.batch_size:
+                ready.append(self.pending[:self.batch_size])
+                del self.pending[:self.batch_size]
+            if ready and self.pending:
+                self.first_at = now
+        if ready or not self.pending:
+            return ready
+        if self.max_latency is not None and now - self.first_at >= self.max_latency:
+            return ready + [self.drain()]
+        return ready
+
+    def timeout(self, now):
+        # Сколько можно ждать следующего элемента, не нарушив max_latency (None - без ограничения)
+        if not self.pending or self.max_latency is None:
+            return None
+        return max(0.0, self.first_at + self.max_latency - now)
+
+    def drain(self):
+        batch, self.pending, self.first_at = self.pending, [], None
+        return batch
+
+class ThreadSubscription:
+    # Подписчик со своим потоком: колбек вызывается только из этого потока
+
+    def __init__(self, callback, batch_size=None, max_latency=None, queue_limits=cfg.QUEUE_LIMITS["subscriber"]):
+        self.callback = callback
+        self.name = callback_name(callback)
+        self.batcher = Batcher(batch_size, max_latency)
+        self.queue = bq.BoundedQueue(f"subscriber:{self.name}", coalesce=coalesce_items, **queue_limits)
+        self._thread = None
+
+    @property
+    def dropped(self):
+        return self.queue.dropped
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self.queue.reopen()
+            self._thread = threading.Thread(target=self._run, name=f"STTSubscriber-{self.name}", daemon=True)
+            self._thread.start()
+
+    def put(self, item):
+        try:
+            if not self.queue.put_nowait(item):
+                logging.warning(f"STTPublisher: очередь подписчика '{self.name}' переполнена, данные пропущены.")
+        except queue.Full:
+            logging.warning(f"STTPublisher: очередь подписчика '{self.name}' переполнена, данные пропущены.")
+
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        self.queue.close() # Остаток очереди и пакета будет отправлен перед остановкой
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logging.warning(f"STTPublisher: поток подписчика '{self.name}' не завершился вовремя.")
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.batcher.timeout(time.monotonic()))
+            except queue.Empty: # Истёк max_latency
+                self._call(self.batcher.drain())
+                continue
+
+            if item is None:
+                if self.batcher.pending:
+                    self._call(self.batcher.drain())
+                break
+
+            if type(item) is list:
+                for batch in self.batcher.add(item, time.monotonic()):
+                    self._call(batch)
+            else:
+                if self.batcher.pending: # Сохраняем порядок: сначала накопленные реплики
+                    self._call(self.batcher.drain())
+                if isinstance(item, HistoryRequest):
+                    for page in item.pages():
+                        self._call(page)
+                else:
+                    self._call(item)
+
+        logging.debug(f"STTPublisher: поток подписчика '{self.name}' остановлен.")
+
+    def _call(self, item):
+        _observe_dispatch(item)
+        call_start = time.perf_counter()
+        try:
+            self.callback(item)
+            _CALLBACK.observe(time.perf_counter() - call_start)
+        except Exception as e:
+            logging.error(f"STTPublisher: ошибка при вызове колбека подписчика '{self.name}': {e}.")
+
+class AsyncSubscription:
+    # Подписчик-корутина: выполняется задачей в заданном цикле событий asyncio.
+    # Производители (потоки движка) передают элементы через call_soon_threadsafe.
+
+    def __init__(self, callback, loop, batch_size=None, max_latency=None, queue_limits=cfg.QUEUE_LIMITS["subscriber"]):
+        if queue_limits["policy"] == bq.BLOCK:
+            raise ValueError("Подписчик asyncio не может блокировать производителя: выберите drop_* или coalesce.")
+
+        self.callback = callback
+        self.loop = loop
+        self.name = callback_name(callback)
+        self.batcher = Batcher(batch_size, max_latency)
+        self.maxsize = queue_limits["maxsize"]
+        self.policy = queue_limits["policy"]
+        self.coalesce_max = queue_limits.get("coalesce_max")
+        self.items = collections.deque() # Доступ только из потока цикла событий
+        self._has_items = asyncio.Event()
+        self.dropped = 0
+        self._closed = False # Сигнал остановки - флаг, а не элемент очереди, чтобы его нельзя было вытеснить
+        self._future = None
+
+    def start(self):
+        if self._future is None or self._future.done():
+            self._closed = False
+            self._future = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    def put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError: # Цикл событий уже закрыт
+            pass
+
+    def close(self, timeout=5):
+        if self._future is None:
+            return
+        future, self._future = self._future, None
+        try:
+            self.loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            return
+
+        if self._in_loop_thread():
+            return # Ждать задачу из её же цикла нельзя - она завершится сама
+        try:
+            future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            logging.warning(f"STTPublisher: задача подписчика '{self.name}' не завершилась вовремя.")
+        except Exception as e:
+            logging.error(f"STTPublisher: ошибка в задаче подписчика '{self.name}': {e}.")
+
+    def _in_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _put(self, item):
+        if len(self.items) >= self.maxsize:
+            if self.policy == bq.COALESCE:
+                merged = coalesce_items(self.items[-1], item)
+                if merged is not None:
+                    merged, trimmed = bq.trim_merged(merged, self.coalesce_max)
+                    self.items[-1] = merged
+                    if trimmed:
+                        self.dropped += trimmed
+                        _ASYNC_DROPPED.inc(trimmed)
+                    return
+            self.dropped += 1
+            _ASYNC_DROPPED.inc()
+            logging.warning(f"STTPublisher: очередь подписчика '{self.name}' переполнена, данные пропущены.")
+            if self.policy == bq.DROP_NEWEST:
+                return
+            self.items.popleft()
+        self._append(item)
+
+    def _append(self, item):
+        self.items.append(item)
+        self._has_items.set()
+
+    def _close(self):
+        self._closed = True
+        self._has_items.set()
+
+    async def _run(self):
+        while True:
+            if not self.items:
+                if self._closed: # Очередь разобрана - отправляем остаток пакета и завершаемся
+                    if self.batcher.pending:
+                        await self._call(self.batcher.drain())
+                    break
+                self._has_items.clear()
+                try:
+                    await asyncio.wait_for(self._has_items.wait(), self.batcher.timeout(time.monotonic()))
+                except asyncio.TimeoutError: # Истёк max_latency
+                    await self._call(self.batcher.drain())
+                continue
+            item = self.items.popleft()
+
+            if type(item) is list:
+                for batch in self.batcher.add(item, time.monotonic()):
+                    await self._call(batch)
+            else:
+                if self.batcher.pending:
+                    await self._call(self.batcher.drain())
+                if isinstance(item, HistoryRequest):
+                    # Чтение с диска - в пуле потоков, чтобы не блокировать цикл событий
+                    pages = item.pages()
+                    while (page := await asyncio.to_thread(next, pages, None)) is not None:
+                        await self._call(page)
+                else:
+                    await self._call(item)
+
+        logging.debug(f"STTPublisher: задача подписчика '{self.name}' остановлена.")
+
+    async def _call(self, item):
+        _observe_dispatch(item)
+        call_start = time.perf_counter()
+        try:
+            result = self.callback(item)
+            if inspect.isawaitable(result):
+                await result
+            _CALLBACK.observe(time.perf_counter() - call_start)
+        except Exception as e:
+            logging.error(f"STTPublisher: ошибка при вызове колбека подписчика '{self.name}': {e}.")
+
+def make_subscription(callback, batch_size=None, max_latency=None, loop=None, queue_limits=None):
+    # Корутины (и любые колбеки с заданным loop) выполняются в цикле событий, остальные - в своём потоке
+    queue_limits = queue_limits or cfg.QUEUE_LIMITS["subscriber"]
+    if loop is None and inspect.iscoroutinefunction(callback):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise ValueError(f"Подписчику-корутине '{callback_name(callback)}' нужен цикл событий (loop).")
+    if loop is not None:
+        return AsyncSubscription(callback, loop, batch_size, max_latency, queue_limits)
+    return ThreadSubscription(callback, batch_size, max_latency, queue_limits)
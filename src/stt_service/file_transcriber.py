@@ -0,0 +1,167 @@
+import concurrent.futures
+import multiprocessing
+import soundfile as sf
+import ring_buffer as rb
+import resampler as rs
+import whisper as wr
+import autotune as at
+import config as cfg
+import argparse
+import logging
+import torch
+import time
+import os
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg')
+
+_worker_engine = None # Движок STT процесса-воркера (одна модель на процесс)
+
+def format_timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+def find_audio_files(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(AUDIO_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            logging.warning(f"Файл или каталог '{path}' не найден, пропускаем.")
+    return files
+
+def transcribe_file(engine, path):
+    # Детерминированный путь без микрофона и потоков: файл читается блоками по FILE_CHUNK_SEC
+    # через тот же кольцевой буфер и потоковый VAD, готовые сегменты декодируются пакетами.
+    ring_buffer = rb.RingBuffer(int(cfg.SAMPLE_RATE * cfg.RING_BUFFER_SEC))
+    vad = engine.new_vad()
+    vad.reset(0)
+
+    utterances = []
+    pending = []
+
+    def decode_pending():
+        results = engine.batch_decoder.decode([audio for _, _, audio in pending], **cfg.DECODE_PROFILES[cfg.DECODE_DEFAULT_PROFILE])
+        for (start, end, _), result in zip(pending, results):
+            if result.text:
+                utterances.append((start / cfg.SAMPLE_RATE, end / cfg.SAMPLE_RATE, result.text))
+        pending.clear()
+
+    def take_segments(events):
+        for event in events:
+            if 'end' in event:
+                # Копируем: следующий блок файла может перезаписать этот участок буфера
+                pending.append((event['start'], event['end'], ring_buffer.view(event['start'], event['end']).copy()))
+        if len(pending) >= cfg.DECODE_BATCH_SIZE:
+            decode_pending()
+
+    with sf.SoundFile(path) as audio_file:
+        # Файл любой частоты и с любым числом каналов приводится к моно SAMPLE_RATE поблочно
+        resampler = rs.StreamingResampler(audio_file.samplerate, cfg.SAMPLE_RATE, audio_file.channels)
+        chunk_size = int(audio_file.samplerate * cfg.FILE_CHUNK_SEC)
+        for block in audio_file.blocks(blocksize=chunk_size, dtype='float32', always_2d=True):
+            resampler.write_to(ring_buffer, block)
+            take_segments(vad.process(ring_buffer))
+
+    tail = resampler.flush()
+    if len(tail):
+        ring_buffer.write(tail)
+    take_segments(vad.process(ring_buffer))
+    take_segments(vad.flush())
+    if pending:
+        decode_pending()
+
+    return utterances, ring_buffer.end / cfg.SAMPLE_RATE
+
+def write_transcript(utterances, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for start, end, text in utterances:
+            f.write(f"[{format_timestamp(start)} - {format_timestamp(end)}] {text}\n")
+
+def _init_worker(cpu_threads):
+    global _worker_engine
+
+    logging.basicConfig(level=cfg.LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Каждый процесс получает свою долю ядер; прогрев для пакетной обработки не нужен
+    cfg.CPU_THREADS = cpu_threads
+    cfg.NUM_WORKERS = 1
+    cfg.WARMUP_ENABLE = False
+    # Разбиение ядер здесь своё (по процессам), из замера autotune берём только COMPUTE_TYPE
+    cfg.AUTOTUNE = "off"
+    entry = at.load_cached()
+    if entry is not None:
+        cfg.COMPUTE_TYPE = entry["config"]["COMPUTE_TYPE"]
+    torch.set_num_threads(1)
+
+    _worker_engine = wr.STTEngine()
+    if not _worker_engine.load():
+        raise RuntimeError("Не удалось загрузить модели в процессе-воркере.")
+
+def _transcribe_job(path, output_dir):
+    start_time = time.perf_counter()
+    output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".txt")
+    try:
+        utterances, duration = transcribe_file(_worker_engine, path)
+        write_transcript(utterances, output_path)
+    except Exception as e:
+        logging.error(f"Ошибка при транскрипции файла '{path}': {e}")
+        return dict(path=path, error=str(e))
+
+    return dict(path=path, output=output_path, utterances=len(utterances),
+                duration_sec=duration, elapsed_sec=time.perf_counter() - start_time)
+
+def transcribe_files(paths, output_dir, workers=cfg.FILE_WORKERS, threads_per_worker=cfg.FILE_CPU_THREADS_PER_WORKER):
+    os.makedirs(output_dir, exist_ok=True)
+    if workers <= 0:
+        workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    workers = min(workers, len(paths)) or 1
+
+    logging.info(f"Транскрипция {len(paths)} файлов в {workers} процессах...")
+
+    results = []
+    # spawn: torch и CTranslate2 небезопасно наследовать через fork
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads_per_worker,)) as executor:
+        futures = [executor.submit(_transcribe_job, path, output_dir) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if 'error' not in result:
+                logging.info(f"{result['path']}: {result['utterances']} реплик, "
+                             f"RTF {result['elapsed_sec'] / max(result['duration_sec'], 1e-9):.3f}")
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная транскрипция аудиофайлов (WAV/FLAC/OGG).")
+    parser.add_argument("inputs", nargs="+", help="Файлы или каталоги с аудио")
+    parser.add_argument("-o", "--output-dir", default="transcripts", help="Каталог для транскриптов")
+    parser.add_argument("-j", "--workers", type=int, default=cfg.FILE_WORKERS, help="Число процессов (0 - по числу ядер)")
+    parser.add_argument("-t", "--threads", type=int, default=cfg.FILE_CPU_THREADS_PER_WORKER, help="Потоков Whisper на процесс")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    paths = find_audio_files(args.inputs)
+    if not paths:
+        logging.error("Не найдено ни одного аудиофайла.")
+        return 1
+
+    start_time = time.perf_counter()
+    results = transcribe_files(paths, args.output_dir, args.workers, args.threads)
+    elapsed = time.perf_counter() - start_time
+
+    done = [r for r in results if 'error' not in r]
+    audio_duration = sum(r['duration_sec'] for r in done)
+    print(f"Готово: {len(done)}/{len(results)} файлов, {audio_duration:.1f} с аудио за {elapsed:.1f} с "
+          f"(в {audio_duration / max(elapsed, 1e-9):.1f} раз быстрее реального времени).")
+    return 0 if len(done) == len(results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+from typing import NamedTuple
+import utterance as ut
+import config as cfg
+import threading
+import weakref
+import bisect
+import array
+import json
+import uuid
+import os
+import re
+
+class HistoryEntry(NamedTuple):
+    index: int # Порядковый номер реплики с начала сессии
+    timestamp: float # Время публикации (time.time())
+    utterance: ut.Utterance
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class UtteranceHistory:
+    # История реплик: в памяти хранится только хвост из memory_items записей, более старые
+    # дописываются в файл-сегмент (JSON Lines, только добавление). Для чтения с диска в памяти
+    # остаются лишь смещения и времена записей - по 16 байт на реплику.
+
+    def __init__(self, name="history", memory_items=cfg.HISTORY_MEMORY_ITEMS, spill_dir=cfg.HISTORY_DIR):
+        if memory_items <= 0:
+            raise ValueError("История: размер хвоста в памяти должен быть положительным.")
+
+        self.name = name
+        self.memory_items = memory_items
+        self.spill_dir = spill_dir
+        self.path = None # Файл-сегмент создаётся при первом вытеснении
+
+        self._tail = [] # Последние записи (HistoryEntry), _tail[0].index == self._spilled
+        self._spilled = 0 # Сколько первых записей уже на диске
+        self._offsets = array.array('q') # Смещение каждой записи на диске
+        self._times = array.array('d') # Время каждой записи на диске (для поиска по времени)
+        self._file = None
+        self._file_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._spilled + len(self._tail)
+
+    def append(self, utterance, timestamp=None):
+        if timestamp is None:
+            timestamp = utterance.published_at
+        with self._lock:
+            entry = HistoryEntry(len(self), timestamp, utterance)
+            self._tail.append(entry)
+            if len(self._tail) > self.memory_items:
+                # Вытесняем четверть хвоста разом, чтобы не писать на диск при каждой реплике
+                self._spill(len(self._tail) - self.memory_items * 3 // 4)
+            return entry.index
+
+    def page(self, offset=0, limit=cfg.HISTORY_PAGE_SIZE):
+        # Записи [offset, offset + limit); отрицательный offset - от конца истории
+        with self._lock:
+            total = len(self)
+            if offset < 0:
+                offset = max(0, total + offset)
+            end = total if limit is None else min(total, offset + limit)
+            if offset >= end:
+                return []
+
+            spilled = self._spilled
+            entries = self._tail[max(0, offset - spilled):max(0, end - spilled)]
+            disk_offsets = self._offsets[offset:min(end, spilled)] if offset < spilled else None
+
+        if disk_offsets:
+            # Уже записанные строки неизменны - читаем без блокировки, не задерживая publish
+            entries = self._read(disk_offsets) + entries
+        return entries
+
+    def pages(self, offset=0, start_time=None, end_time=None, page_size=cfg.HISTORY_PAGE_SIZE):
+        # Постранично: записи начиная с offset и/или в интервале времени [start_time, end_time)
+        if start_time is not None:
+            offset = max(offset, self.find_time(start_time))
+        stop = len(self) if end_time is None else self.find_time(end_time)
+
+        while offset < stop:
+            entries = self.page(offset, min(page_size, stop - offset))
+            if not entries:
+                break
+            yield entries
+            offset += len(entries)
+
+    def find_time(self, timestamp):
+        # Номер первой записи, опубликованной не раньше timestamp
+        with self._lock:
+            if self._tail and self._tail[0].timestamp <= timestamp:
+                return self._spilled + bisect.bisect_left([e.timestamp for e in self._tail], timestamp)
+            return bisect.bisect_left(self._times, timestamp)
+
+    def close(self):
+        # Закрывает файл для записи; при следующем вытеснении он откроется снова.
+        # Сам файл удаляется вместе с объектом истории (если не HISTORY_KEEP_FILES).
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _spill(self, count):
+        if self.path is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            safe_name = re.sub(r'[^\w.-]', '_', str(self.name))
+            self.path = os.path.join(self.spill_dir, f"{safe_name}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+            if not cfg.HISTORY_KEEP_FILES:
+                weakref.finalize(self, _remove_file, self.path)
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+
+        lines = []
+        for entry in self._tail[:count]:
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' # [index, timestamp, [поля Utterance]]
+            self._offsets.append(self._file_size)
+            self._times.append(entry.timestamp)
+            self._file_size += len(line)
+            lines.append(line)
+        self._file.write(b''.join(lines))
+        self._file.flush() # До сдвига границы: читатели обращаются к файлу без блокировки
+
+        del self._tail[:count]
+        self._spilled += count
+
+    def _read(self, offsets):
+        # Смещения идут подряд - одно позиционирование и последовательное чтение
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(offsets[0])
+            for _ in range(len(offsets)):
+                index, timestamp, fields = json.loads(f.readline())
+                entries.append(HistoryEntry(index, timestamp, ut.Utterance.from_wire(fields)))
+        return entries
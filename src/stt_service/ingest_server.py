@@ -0,0 +1,141 @@
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from stt_publisher import STTPublisher
+from contextlib import asynccontextmanager
+import bounded_queue as bq
+import metrics as mt
+import whisper as wr
+import config as cfg
+import numpy as np
+import logging
+import asyncio
+import uvicorn
+
+# Сервер приёма аудио: по WebSocket на каждый звонок приходят PCM-кадры,
+# распознанные реплики отправляются обратно в тот же сокет.
+
+SAMPLE_FORMATS = {
+    "pcm_s16le": (np.dtype('<i2'), 1.0 / 32768.0),
+    "f32le": (np.dtype('<f4'), 1.0),
+}
+
+engine = None # Общий движок STT процесса, загружается при старте сервера
+
+@asynccontextmanager
+async def lifespan(app):
+    global engine
+    engine = await asyncio.to_thread(wr.get_engine)
+    if engine is None:
+        raise RuntimeError("Не удалось инициализировать движок STT.")
+    yield
+    await asyncio.to_thread(engine.stop)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    if engine is None or not engine.is_running:
+        status = "starting"
+    else:
+        status = "ok" if engine.ready.is_set() else "warming_up"
+    return {"status": status,
+            "startup_timings": engine.startup_timings if engine is not None else {},
+            "decode_profile": engine.profile_controller.stats() if engine is not None else {},
+            "queues": bq.all_stats(),
+            "sessions": len(engine.sessions()) if engine is not None else 0}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(mt.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/sessions")
+async def sessions():
+    return [session.stats() for session in engine.sessions()]
+
+async def _wait_for_vad(session):
+    # Управление потоком: пока VAD сессии отстаёт больше чем на INGEST_MAX_BACKLOG_SEC,
+    # не читаем сокет - отправитель упирается в окно TCP и замедляется
+    max_backlog = int(cfg.SAMPLE_RATE * cfg.INGEST_MAX_BACKLOG_SEC)
+    while session.is_running and session.ring_buffer.end - session.vad.position > max_backlog:
+        await asyncio.sleep(cfg.INGEST_BACKPRESSURE_POLL_SEC)
+
+@app.websocket("/ws/{call_id}")
+async def ingest(websocket: WebSocket, call_id: str, sample_format: str = "pcm_s16le", sample_rate: int = cfg.SAMPLE_RATE,
+                 channels: int = 1):
+    await websocket.accept()
+
+    # Любая частота (например, 8 кГц телефонии) передискретизируется к SAMPLE_RATE, каналы сводятся в моно
+    if (sample_format not in SAMPLE_FORMATS or not cfg.INGEST_MIN_SAMPLE_RATE <= sample_rate <= cfg.INGEST_MAX_SAMPLE_RATE
+            or not 1 <= channels <= cfg.INGEST_MAX_CHANNELS):
+        await websocket.close(code=1003, reason=f"Ожидается {'/'.join(SAMPLE_FORMATS)}, {cfg.INGEST_MIN_SAMPLE_RATE}-"
+                                                f"{cfg.INGEST_MAX_SAMPLE_RATE} Гц, до {cfg.INGEST_MAX_CHANNELS} каналов.")
+        return
+
+    dtype, scale = SAMPLE_FORMATS[sample_format]
+    loop = asyncio.get_running_loop()
+    send_lock = asyncio.Lock() # Реплики и гипотезы отправляются разными задачами в один сокет
+    send_limits = cfg.QUEUE_LIMITS["ingest_send"]
+
+    async def send(message):
+        async with send_lock:
+            try:
+                await websocket.send_json(message)
+            except (WebSocketDisconnect, RuntimeError): # Клиент уже отключился
+                pass
+
+    async def on_utterances(utterances): # Задача подписчика в цикле событий сервера
+        for utterance in utterances:
+            await send({"type": "utterance", "call_id": call_id, **utterance.to_dict()})
+
+    async def on_partial(update): # Промежуточная гипотеза заменяется следующей репликой "utterance"
+        if not update.is_final:
+            await send({"type": "partial", "call_id": call_id, "utterance_id": update.utterance_id, "text": update.text})
+
+    publisher = STTPublisher(max_batch_size=1, engine=engine, stream_id=call_id, use_microphone=False,
+                             sample_rate=sample_rate, channels=channels)
+    publisher.subscribe(on_utterances, loop=loop, queue_limits=send_limits)
+    if cfg.PARTIALS_ENABLE:
+        publisher.subscribe_partials(on_partial, loop=loop, queue_limits=send_limits)
+    publisher.start()
+    session = publisher.session
+    if session is None:
+        await websocket.close(code=1011, reason="Не удалось открыть сессию STT.")
+        return
+
+    logging.info(f"Ingest: звонок '{call_id}' подключен ({sample_format}, {sample_rate} Гц, каналов: {channels}).")
+    remainder = b"" # Хвост сообщения, не кратный размеру кадра (сэмпл x каналы)
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            data = message.get("bytes")
+            if not data:
+                continue
+
+            data = remainder + data
+            frame_size = dtype.itemsize * channels
+            usable = len(data) - len(data) % frame_size
+            remainder = data[usable:]
+
+            samples = np.frombuffer(data[:usable], dtype=dtype).astype(np.float32)
+            if scale != 1.0:
+                samples *= scale
+
+            await _wait_for_vad(session)
+            publisher.feed(samples)
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error(f"Ingest: ошибка в соединении звонка '{call_id}': {e}")
+    finally:
+        await asyncio.to_thread(publisher.stop) # Дожидаемся остановки сессии и подписчиков, не блокируя цикл событий
+        dropped = sum(subscription.dropped for subscription in publisher.subscribers.values())
+        logging.info(f"Ingest: звонок '{call_id}' отключен (отброшено сообщений: {dropped}).")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=cfg.LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    uvicorn.run(app, host=cfg.INGEST_HOST, port=cfg.INGEST_PORT)
@@ -0,0 +1,250 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config as cfg
+import threading
+import logging
+import bisect
+import math
+
+# Метрики стадий STT: счётчики, показатели (gauge) и гистограммы с фиксированными корзинами.
+# Обновление - одна блокировка и несколько арифметических операций, поэтому метрики можно
+# держать включёнными в продакшене. Чтение: snapshot() (словарь) или render() (текст Prometheus).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATIO_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {} # Значения меток -> состояние
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Метрика '{self.name}': ожидаются метки {self.labelnames}.")
+        return _Child(self, values)
+
+    def _state(self, values):
+        state = self._children.get(values)
+        if state is None:
+            state = self._children.setdefault(values, self._new_state())
+        return state
+
+    def samples(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, values)), self._export(state)) for values, state in self._children.items()]
+
+class _Child:
+    # Метрика с зафиксированными значениями меток
+    __slots__ = ("metric", "values")
+
+    def __init__(self, metric, values):
+        self.metric = metric
+        self.values = values
+
+    def inc(self, amount=1):
+        self.metric._inc(self.values, amount)
+
+    def set(self, value):
+        self.metric._set(self.values, value)
+
+    def observe(self, value):
+        self.metric._observe(self.values, value)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_state(self):
+        return [0.0]
+
+    def _inc(self, values, amount):
+        with self._lock:
+            self._state(values)[0] += amount
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def _export(self, state):
+        return state[0]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_state(self):
+        return [0.0]
+
+    def _set(self, values, value):
+        with self._lock:
+            self._state(values)[0] = value
+
+    def _inc(self, values, amount):
+        with self._lock:
+            self._state(values)[0] += amount
+
+    def set(self, value):
+        self._set((), value)
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def _export(self, state):
+        return state[0]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_state(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0] # Счётчики корзин (последняя - +Inf), сумма, число
+
+    def _observe(self, values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._state(values)
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def observe(self, value):
+        self._observe((), value)
+
+    def _export(self, state):
+        counts, total, count = state
+        cumulative, running = [], 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+_metrics = {} # Имя -> метрика
+_collectors = [] # Функции, возвращающие [(имя, тип, описание, [(метки, значение)])] в момент чтения
+_registry_lock = threading.Lock()
+
+def _get_or_create(cls, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Метрика '{name}' уже зарегистрирована с типом {metric.kind}.")
+        return metric
+
+def counter(name, documentation, labelnames=()):
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+def register_collector(func):
+    with _registry_lock:
+        if func not in _collectors:
+            _collectors.append(func)
+
+def unregister_collector(func):
+    with _registry_lock:
+        if func in _collectors:
+            _collectors.remove(func)
+
+def _families():
+    with _registry_lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    families = [(m.name, m.kind, m.documentation, m.samples()) for m in metrics]
+    for collect in collectors:
+        try:
+            families.extend(collect())
+        except Exception as e:
+            logging.warning(f"Метрики: ошибка сборщика '{getattr(collect, '__name__', collect)}': {e}")
+    return families
+
+def snapshot():
+    # {имя: {"type", "help", "samples": [{"labels": {...}, "value": ...}]}}; у гистограмм value -
+    # {"buckets": [(граница, накопленное число)], "sum", "count"}
+    return {name: {"type": kind, "help": documentation,
+                   "samples": [{"labels": labels, "value": value} for labels, value in samples]}
+            for name, kind, documentation, samples in _families()}
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+def render():
+    # Текстовый формат экспозиции Prometheus 0.0.4
+    lines = []
+    for name, kind, documentation, samples in _families():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind == "histogram":
+                for bound, count in value["buckets"]:
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # Без записи каждого запроса в stderr
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_http_server(host=cfg.METRICS_HOST, port=cfg.METRICS_PORT):
+    # Локальная HTTP-точка /metrics в фоновом потоке; повторный вызов ничего не делает
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            logging.warning(f"Метрики: не удалось открыть порт {host}:{port}: {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="STTMetrics", daemon=True).start()
+        logging.info(f"Метрики доступны на http://{host}:{_server.server_address[1]}/metrics")
+        return _server
+
+def stop_http_server():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
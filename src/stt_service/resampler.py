@@ -0,0 +1,108 @@
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin
+import config as cfg
+import numpy as np
+import math
+
+# Потоковая передискретизация к SAMPLE_RATE: полифазный КИХ-фильтр (как scipy.signal.resample_poly),
+# состояние которого - хвост входа и номер следующего выходного сэмпла - сохраняется между блоками.
+# Для каждого выходного сэмпла считается только одна фаза фильтра: L = len(h) / up умножений.
+
+def downmix(samples, channels=1):
+    # Многоканальный вход -> моно float32. samples: (кадры, каналы) или чередующиеся каналы в 1D
+    samples = np.asarray(samples)
+    if samples.ndim == 1 and channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    if samples.ndim == 2:
+        samples = samples[:, 0] if samples.shape[1] == 1 else samples.mean(axis=1)
+    return samples.astype(np.float32, copy=False)
+
+class StreamingResampler:
+
+    def __init__(self, source_rate, target_rate=cfg.SAMPLE_RATE, channels=1):
+        self.source_rate = int(source_rate)
+        self.target_rate = int(target_rate)
+        self.channels = channels
+
+        divisor = math.gcd(self.source_rate, self.target_rate)
+        self.up = self.target_rate // divisor
+        self.down = self.source_rate // divisor
+        self.passthrough = self.up == self.down
+
+        if not self.passthrough:
+            # Тот же фильтр, что по умолчанию в resample_poly: окно Кайзера (beta=5), 10 периодов с каждой стороны
+            max_rate = max(self.up, self.down)
+            half_len = 10 * max_rate
+            h = firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * self.up
+            self.taps = -(-len(h) // self.up) # Коэффициентов в одной фазе
+            h = np.pad(h, (0, self.taps * self.up - len(h)))
+            # phases[p, j] = h[p + j * up]; развёрнуты, чтобы умножать на окно входа в прямом порядке
+            self.phases = np.ascontiguousarray(h.reshape(self.taps, self.up).T[:, ::-1]).astype(np.float32)
+            self.delay = half_len # Групповая задержка фильтра (в сэмплах после повышения частоты) - компенсируем
+        self.reset()
+
+    def reset(self):
+        self.samples_in = 0 # Принято входных сэмплов (моно)
+        self.samples_out = 0 # Выдано выходных сэмплов
+        if not self.passthrough:
+            # Перед началом потока - нули, чтобы первые выходные сэмплы имели полное окно
+            self._buffer = np.zeros(self.taps - 1, dtype=np.float32)
+            self._buffer_start = -(self.taps - 1) # Абсолютный номер входного сэмпла _buffer[0]
+
+    def process(self, samples):
+        samples = downmix(samples, self.channels)
+        self.samples_in += len(samples)
+        if self.passthrough:
+            self.samples_out += len(samples)
+            return samples
+
+        self._buffer = np.concatenate((self._buffer, samples))
+        return self._emit(self._last_ready(self.samples_in))
+
+    def flush(self):
+        # Остаток потока: выходных сэмплов всего ceil(вход * up / down), как у resample_poly
+        if self.passthrough:
+            return np.zeros(0, dtype=np.float32)
+        total = -(-self.samples_in * self.up // self.down)
+        padding = (self.delay // self.up) + self.taps + 1
+        self._buffer = np.concatenate((self._buffer, np.zeros(padding, dtype=np.float32)))
+        return self._emit(min(total, self._last_ready(self.samples_in + padding)))
+
+    def write_to(self, ring, samples):
+        # Передискретизированный блок сразу пишется в кольцевой буфер сессии
+        output = self.process(samples)
+        if len(output):
+            ring.write(output)
+        return len(output)
+
+    def _last_ready(self, available):
+        # Номер первого выходного сэмпла, для которого ещё не хватает входа
+        numerator = available * self.up - 1 - self.delay
+        return numerator // self.down + 1 if numerator >= 0 else 0
+
+    def _emit(self, end):
+        start = self.samples_out
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+
+        positions = np.arange(start, end, dtype=np.int64) * self.down + self.delay
+        inputs = positions // self.up - self._buffer_start # Последний входной сэмпл окна каждого выхода
+        phases = positions % self.up
+
+        windows = sliding_window_view(self._buffer, self.taps)[inputs - self.taps + 1]
+        output = np.einsum('ij,ij->i', windows, self.phases[phases]).astype(np.float32, copy=False)
+        self.samples_out = end
+
+        # Входные сэмплы старше окна следующего выхода больше не нужны
+        next_input = (end * self.down + self.delay) // self.up
+        keep_from = max(0, next_input - self.taps + 1 - self._buffer_start)
+        self._buffer = self._buffer[keep_from:]
+        self._buffer_start += keep_from
+        return output
+
+def resample(audio, source_rate, target_rate=cfg.SAMPLE_RATE, channels=1):
+    # Однократная передискретизация целого сигнала
+    resampler = StreamingResampler(source_rate, target_rate, channels)
+    if resampler.passthrough:
+        return resampler.process(audio)
+    return np.concatenate((resampler.process(audio), resampler.flush()))
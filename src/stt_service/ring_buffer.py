@@ -0,0 +1,96 @@
+import collections
+import threading
+import numpy as np
+import time
+
+class RingBuffer:
+    # Кольцевой буфер фиксированной ёмкости для аудио (float32).
+    # Позиции везде абсолютные: номер сэмпла с начала потока, а не индекс в массиве.
+    # Каждый сэмпл хранится дважды (в i и i + capacity), поэтому любое окно
+    # длиной не больше capacity доступно как непрерывный срез без копирования.
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("Ёмкость кольцевого буфера должна быть положительной.")
+
+        self.capacity = int(capacity)
+        self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._write_pos = 0 # Абсолютный индекс следующего записываемого сэмпла
+        self._lock = threading.Lock() # Защищает запись от нескольких писателей
+        self._data_ready = threading.Condition(self._lock) # Будит читателей при поступлении данных
+        self.overruns = 0 # Сколько раз блок не поместился в буфер целиком
+        self._write_times = collections.deque(maxlen=4096) # (позиция конца блока, time.monotonic() записи)
+
+    @property
+    def start(self):
+        # Самый старый сэмпл, который ещё хранится в буфере
+        return max(0, self._write_pos - self.capacity)
+
+    @property
+    def end(self):
+        # Позиция за последним записанным сэмплом
+        return self._write_pos
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim != 1:
+            samples = samples.reshape(-1)
+
+        total = len(samples)
+        if total == 0:
+            return
+
+        with self._lock:
+            if total > self.capacity: # В буфер помещается только хвост блока
+                samples = samples[-self.capacity:]
+                self.overruns += 1
+
+            n = len(samples)
+            pos = (self._write_pos + total - n) % self.capacity
+            first = min(n, self.capacity - pos)
+            rest = n - first
+
+            self._data[pos:pos + first] = samples[:first]
+            self._data[pos + self.capacity:pos + self.capacity + first] = samples[:first]
+            if rest:
+                self._data[:rest] = samples[first:]
+                self._data[self.capacity:self.capacity + rest] = samples[first:]
+
+            # Позицию сдвигаем только после записи данных, чтобы читатель не увидел пустой хвост
+            self._write_pos += total
+            self._write_times.append((self._write_pos, time.monotonic()))
+            self._data_ready.notify_all()
+
+    def wait(self, position, timeout=None):
+        # Блокируется, пока в буфер не будет записан сэмпл position - 1 (или до таймаута/wake)
+        with self._data_ready:
+            if self._write_pos < position:
+                self._data_ready.wait(timeout)
+            return self._write_pos >= position
+
+    def write_time(self, position):
+        # time.monotonic() записи блока, в котором пришёл сэмпл position - 1 (None - запись уже забыта)
+        with self._lock:
+            written_at = None
+            for end, block_time in reversed(self._write_times):
+                if end < position:
+                    break
+                written_at = block_time
+            return written_at
+
+    def wake(self):
+        # Будит всех ожидающих читателей (например, при остановке)
+        with self._data_ready:
+            self._data_ready.notify_all()
+
+    def view(self, start, end):
+        # Возвращает срез без копирования. Данные действительны, пока is_valid(start) истинно.
+        if start < self.start or end > self._write_pos or start > end:
+            raise IndexError(f"Диапазон [{start}, {end}) вне буфера [{self.start}, {self._write_pos}).")
+
+        offset = start % self.capacity
+        return self._data[offset:offset + (end - start)]
+
+    def is_valid(self, start):
+        # Проверка, что данные начиная с start ещё не затёрты новой записью
+        return start >= self.start
@@ -1,12 +1,13 @@
+import delivery as dl
+import history as hs
 import whisper as wr
 import config as cfg
 import threading
 import logging 
-import queue 
 import sys 
 
 class STTPublisher:
-    def __init__(self, max_batch_size=2):
+    def __init__(self, max_batch_size=2, engine=None, stream_id=None, use_microphone=True, sample_rate=cfg.SAMPLE_RATE, channels=None):
 
         if cfg.WRITE_TO_FILE:
             logging.basicConfig(level=cfg.LOGGING_LEVEL, 
@@ -17,23 +18,23 @@ class STTPublisher:
         else:
             logging.basicConfig(level=cfg.LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 
-        self._utterances_history_lock = threading.Lock()
-        self.all_utterances = []
-        self.subscribers = []
-        self.max_batch_size = max_batch_size # размер отправляемого пакета
-        self._new_utterances_buffer = [] # <-- Буфер для накопления реплик для следующего пакета
+        self.history = hs.UtteranceHistory(name=stream_id or "publisher") # Хвост в памяти, остальное - на диске
+        self.subscribers = {} # колбек -> подписка (своя очередь и свой поток или задача asyncio)
+        self.partial_subscribers = {} # Получают TranscriptUpdate: промежуточные гипотезы и заменяющие их финалы
+        self.max_batch_size = max_batch_size # размер пакета для подписчиков без своего правила пакетирования
 
-        self._publish_queue = queue.Queue() # Очередь для данных, ожидающих отправки подписчикам
-        self._subscribers_lock = threading.Lock() # Блокировка для потокобезопасного доступа к списку подписчиков
-        self._dispatcher_thread = None # Поток, который будет вызывать колбеки
-        self._dispatcher_stop_event = threading.Event() # Событие для сигнализации остановки потока-диспетчера
+        self._subscribers_lock = threading.Lock() # Блокировка для потокобезопасного доступа к спискам подписчиков
         self._is_running = False # Флаг состояния издателя
 
-        self._stt_thread = None # Поток, в котором будет выполняться transcribe_audio
+        self.stream_id = stream_id
+        self.use_microphone = use_microphone # False - аудио подаётся извне через feed()
+        self.sample_rate = sample_rate # Частота входа (передискретизируется к SAMPLE_RATE)
+        self.channels = channels if channels is not None else (cfg.CHANNELS if use_microphone else 1) # Многоканальный вход сводится в моно
+        self._session = None # Сессия движка STT, из которой приходят реплики
 
         logging.debug("STTPublisher: инициализация...") 
-        success = wr.init_transcribe()
-        if not success:
+        self._engine = engine if engine is not None else wr.get_engine() # По умолчанию - общий движок процесса
+        if self._engine is None:
             logging.error("STTPublisher: ошибка инициализации.")
             sys.exit(1)
         logging.debug("STTPublisher: инициализация завершена.") 
@@ -42,149 +43,166 @@ class STTPublisher:
         logging.debug("STTPublisher: инициализация потоков транскрибации и публикации...")
         if not self._is_running:
             self._is_running = True
-            wr.is_running = True
 
-            self._stt_thread = threading.Thread(target=wr.transcribe_audio, args=(self,), name="STTProcessor")
-            self._stt_thread.daemon = True 
-            self._stt_thread.start()
-            logging.debug("STTPublisher: поток транскрибации запущен.")
-
-            self._dispatcher_stop_event.clear()
-            self._dispatcher_thread = threading.Thread(target=self._dispatcher_loop, name="STTDispatcher")
-            self._dispatcher_thread.daemon = True
-            self._dispatcher_thread.start()
-            logging.debug("STTPublisher: поток публикации запущен.")
+            self._session = self._engine.open_session(self, stream_id=self.stream_id, use_microphone=self.use_microphone,
+                                                      sample_rate=self.sample_rate, channels=self.channels)
+            if not self._session.start():
+                logging.error("STTPublisher: не удалось запустить сессию транскрибации.")
+                self._session.stop()
+                self._session = None
+                self._is_running = False
+                return
+            self.stream_id = self._session.stream_id
+            logging.debug(f"STTPublisher: сессия транскрибации '{self.stream_id}' запущена.")
+
+            for subscription in self._all_subscriptions():
+                subscription.start()
+            logging.debug("STTPublisher: подписчики запущены.")
 
     def stop(self):
         if self._is_running:
             logging.debug("STTPublisher: остановка...")
             self._is_running = False
-            wr.is_running = False 
-
-            if self._stt_thread and self._stt_thread.is_alive():
-                self._stt_thread.join(timeout=10)
-                if self._stt_thread.is_alive():
-                    logging.warning("STTPublisher: поток транскрибации не завершился вовремя.")
-
-            if self._new_utterances_buffer: 
-                try:
-                    self._publish_queue.put_nowait(list(self._new_utterances_buffer))
-                    self._new_utterances_buffer = [] 
-                except queue.Full: 
-                    logging.warning("STTPublisher: очередь публикации заполнена, оставшиеся реплики могут быть потеряны.")
-                except Exception as e: 
-                    logging.error(f"STTPublisher: ошибка при публикации: {e}")
-
-            self._dispatcher_stop_event.set() 
-            if self._dispatcher_thread and self._dispatcher_thread.is_alive():
-                self._dispatcher_thread.join(timeout=5) # Ждем завершения потока диспетчера
-                if self._dispatcher_thread.is_alive():
-                    logging.warning("STTPublisher: поток диспетчера не завершился вовремя.")
-            
-            logging.debug("STTPublisher: остановлен.")
 
-    def _dispatcher_loop(self):
+            if self._session is not None:
+                self._session.stop()
+                self._session = None
 
-        while True: 
-            try:
-                item = self._publish_queue.get(timeout=0.1) 
-                if item is None: 
-                    break
-                
-                if isinstance(item, list):
-                    subscribers_copy = []
-                    with self._subscribers_lock:
-                        subscribers_copy = list(self.subscribers)
-
-                    utterance_batch = item 
-                    for callback in subscribers_copy:
-                        try:
-                            callback(utterance_batch) 
-                        except Exception as e:
-                            callback_name = callback.__name__ if hasattr(callback, '__name__') else 'callback'
-                            logging.error(f"STTPublisher: ошибка при вызове колбека подписчика '{callback_name}': {e}.")
-                            pass
-
-                elif isinstance(item, tuple) and len(item) == 2: 
-                    target_callback, history_data = item 
-                    if callable(target_callback):
-                        try:
-                            target_callback(history_data) 
-                            logging.debug(f"История отправлена подписчику '{target_callback.__name__ if hasattr(target_callback, '__name__') else 'callback'}'.")
-                        except Exception as e:
-                            callback_name = target_callback.__name__ if hasattr(target_callback, '__name__') else 'callback'
-                            logging.error(f"Ошибка при отправке истории подписчику '{callback_name}': {e}.")
-
-            except queue.Empty:
-                pass 
-            except Exception as e:
-                logging.error(f"STTPublisher: неожиданная ошибка в цикле диспетчера: {e}.")
+            # Каждый подписчик отправляет накопленный пакет и останавливается
+            for subscription in self._all_subscriptions():
+                subscription.close()
             
-        logging.debug("STTPublisher: поток публикации остановлен.")
+            self.history.close()
+            logging.debug("STTPublisher: остановлен.")
 
-    def subscribe(self, callback):
+    def _all_subscriptions(self):
         with self._subscribers_lock:
-            if callable(callback) and callback not in self.subscribers:
-                self.subscribers.append(callback)
-                logging.info(f"STTPublisher: подписчик '{callback.__name__ if hasattr(callback, '__name__') else 'callback'}' подписан.")
-                # Опционально: отправить текущую историю при подписке (потокобезопасно)
-                # self._publish_queue.put(self.all_utterances[-self.max_batch_size:]) # Отправка через очередь
-            else:
-                logging.error(f"STTPublisher: ошибка подписки: '{callback}'. Ожидается вызываемый объект (функция).")
+            return list(self.subscribers.values()) + list(self.partial_subscribers.values())
+
+    @property
+    def session(self):
+        return self._session
+
+    def feed(self, samples):
+        # Подача аудио от внешнего источника (при use_microphone=False)
+        if self._session is not None:
+            self._session.feed(samples)
+
+    def subscribe(self, callback, batch_size=None, max_latency=None, loop=None, queue_limits=None):
+        # Каждый подписчик получает свою очередь и своего исполнителя: медленный колбек не задерживает остальных.
+        # batch_size - отдавать пакеты по столько реплик, max_latency - не держать реплику в пакете дольше
+        # стольких секунд (можно задать оба). Без правила используется max_batch_size издателя.
+        # Корутины (async def) и колбеки с заданным loop выполняются в цикле событий loop.
+        # queue_limits - размер и политика очереди подписчика (по умолчанию cfg.QUEUE_LIMITS['subscriber']).
+        if not callable(callback):
+            logging.error(f"STTPublisher: ошибка подписки: '{callback}'. Ожидается вызываемый объект (функция).")
+            return
+
+        if batch_size is None and max_latency is None:
+            batch_size = self.max_batch_size
+        try:
+            subscription = dl.make_subscription(callback, batch_size, max_latency, loop, queue_limits)
+        except ValueError as e: # Корутина без цикла событий или недопустимая политика очереди
+            logging.error(f"STTPublisher: ошибка подписки: {e}")
+            return
+        self._add_subscription(self.subscribers, callback, subscription, "подписчик")
 
     def unsubscribe(self, callback):
-        with self._subscribers_lock:
-            if callback in self.subscribers:
-                self.subscribers.remove(callback)
-                logging.info(f"STTPublisher: подписчик '{callback.__name__ if hasattr(callback, '__name__') else 'callback'}' отписан.")
-            else:
-                logging.error(f"STTPublisher: ошибка отписки: Подписчик '{callback.__name__ if hasattr(callback, '__name__') else 'callback'}' не найден.")
+        self._remove_subscription(self.subscribers, callback, "подписчик")
 
-    def publish(self, new_utterance):
+    def subscribe_partials(self, callback, loop=None, queue_limits=None):
+        # Подписка на промежуточные гипотезы (cfg.PARTIALS_ENABLE). Колбек получает TranscriptUpdate:
+        # is_final=False - гипотеза, is_final=True - окончательный текст той же реплики (utterance_id)
+        if not callable(callback):
+            logging.error(f"STTPublisher: ошибка подписки: '{callback}'. Ожидается вызываемый объект (функция).")
+            return
 
-        if not self._is_running:
-            return 
+        try:
+            subscription = dl.make_subscription(callback, batch_size=1, loop=loop, queue_limits=queue_limits)
+        except ValueError as e:
+            logging.error(f"STTPublisher: ошибка подписки: {e}")
+            return
+        self._add_subscription(self.partial_subscribers, callback, subscription, "подписчик промежуточных результатов")
+
+    def unsubscribe_partials(self, callback):
+        self._remove_subscription(self.partial_subscribers, callback, "подписчик промежуточных результатов")
 
-        if not new_utterance or not new_utterance.strip():
+    def _add_subscription(self, subscriptions, callback, subscription, kind):
+        with self._subscribers_lock:
+            if callback in subscriptions:
+                logging.error(f"STTPublisher: ошибка подписки: {kind} '{subscription.name}' уже подписан.")
+                return
+            subscriptions[callback] = subscription
+        if self._is_running:
+            subscription.start()
+        logging.info(f"STTPublisher: {kind} '{subscription.name}' подписан.")
+
+    def _remove_subscription(self, subscriptions, callback, kind):
+        with self._subscribers_lock:
+            subscription = subscriptions.pop(callback, None)
+        if subscription is None:
+            logging.error(f"STTPublisher: ошибка отписки: {kind} '{dl.callback_name(callback)}' не найден.")
             return
+        subscription.close()
+        logging.info(f"STTPublisher: {kind} '{subscription.name}' отписан.")
 
-        processed_utterance = new_utterance.strip()
-        self.all_utterances.append(processed_utterance) 
+    def publish_update(self, update):
+        # Промежуточные гипотезы не копятся в пакеты и не попадают в историю - отправляются сразу
+        if not self._is_running:
+            return
 
-        self._new_utterances_buffer.append(processed_utterance)
+        with self._subscribers_lock:
+            subscriptions = list(self.partial_subscribers.values())
+        for subscription in subscriptions:
+            subscription.put(update)
 
-        if len(self._new_utterances_buffer) >= self.max_batch_size: 
+    def publish(self, utterance):
+        # utterance - запись utterance.Utterance; подписчики получают её без изменений
 
-            batch_to_send = list(self._new_utterances_buffer) 
-            self._new_utterances_buffer = [] 
+        if not self._is_running:
+            return 
 
-            try: 
-                self._publish_queue.put_nowait(batch_to_send) 
-            except queue.Full:
-                logging.warning("STTPublisher: очередь публикации заполнена. Пакет пропущен.") 
-            except Exception as e: 
-                logging.error(f"STTPublisher: ошибка при постановке пакета в очередь: {e}.")
+        if not utterance.text or not utterance.text.strip():
+            return
 
+        self.history.append(utterance) 
 
-    def send_full_history(self, callback):
+        # Пакеты собирает каждый подписчик по своему правилу
+        with self._subscribers_lock:
+            subscriptions = list(self.subscribers.values())
+        for subscription in subscriptions:
+            subscription.put([utterance])
+
+    def send_full_history(self, callback, offset=0, start_time=None, end_time=None):
+        # История отправляется страницами по cfg.HISTORY_PAGE_SIZE реплик: с номера offset
+        # (отрицательный - от конца) и/или за интервал времени [start_time, end_time) (time.time()).
+        # Страницы читаются в потоке/задаче подписчика, а не копируются здесь целиком.
         if not callable(callback):
             logging.error(f"STTPublisher: невозможно отправить историю, ожидался колбек.")
             return
 
-        logging.debug(f"STTPublisher: запрос на отправку полной истории подписчику '{callback.__name__ if hasattr(callback, '__name__') else 'callback'}'.")
+        logging.debug(f"STTPublisher: запрос на отправку истории подписчику '{dl.callback_name(callback)}'.")
 
-        full_history_copy = []
-        with self._utterances_history_lock: 
-            full_history_copy = list(self.all_utterances)
+        if offset < 0:
+            offset = max(0, len(self.history) + offset)
+        request = dl.HistoryRequest(self.history, offset, start_time, end_time)
 
-        try:
-            self._publish_queue.put_nowait((callback, full_history_copy))
-            logging.debug(f"STTPublisher: запрос истории поставлен в очередь для подписчика '{callback.__name__ if hasattr(callback, '__name__') else 'callback'}'.")
-        except queue.Full:
-            logging.warning("STTPublisher: очередь публикации полна, запрос истории пропущен.")
-        except Exception as e:
-            logging.error(f"STTPublisher: ошибка при постановке запроса истории в очередь: {e}.")
+        with self._subscribers_lock:
+            subscription = self.subscribers.get(callback)
 
+        if subscription is not None:
+            # Через очередь подписчика: история придёт по порядку с пакетами реплик
+            subscription.put(request)
+        else:
+            # Не подписан - одноразовая доставка, не задерживающая вызывающего
+            try:
+                subscription = dl.make_subscription(callback, batch_size=1)
+            except ValueError as e:
+                logging.error(f"STTPublisher: невозможно отправить историю: {e}")
+                return
+            subscription.start()
+            subscription.put(request)
+            threading.Thread(target=subscription.close, name="STTHistory", daemon=True).start()
 
     def is_subscribed(self, callback):
         if not callable(callback):
@@ -193,5 +211,3 @@ class STTPublisher:
         with self._subscribers_lock: 
             return callback in self.subscribers 
 
-
-
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули stt_service импортируются по плоским именам (import config as cfg), как при запуске из каталога сервиса
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
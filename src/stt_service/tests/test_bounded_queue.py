@@ -0,0 +1,100 @@
+import bounded_queue as bq
+import delivery as dl
+import utterance as ut
+import metrics as mt
+import asyncio
+import gc
+import threading
+import time
+
+def _utterance(i):
+    return ut.Utterance("test", i, i * 100, i * 100 + 50, f"реплика {i}", -0.1, 0.01, float(i))
+
+def test_coalesce_queue_stays_bounded_without_consumer():
+    # Подписчик ничего не читает: очередь переполнена, новые пакеты сливаются с последним
+    queue = bq.BoundedQueue("test", maxsize=4, policy=bq.COALESCE, coalesce=dl.coalesce_items, coalesce_max=8)
+    for i in range(1000):
+        assert queue.put_nowait([_utterance(i)])
+
+    retained = sum(len(item) for item in queue._items)
+    assert queue.qsize() == 4
+    assert retained <= 4 * 8
+    assert queue.dropped == 1000 - retained
+    # Остаются самые свежие реплики
+    assert queue._items[-1][-1].utterance_id == 999
+
+def test_async_subscription_coalesce_stays_bounded():
+    limits = dict(maxsize=4, policy=bq.COALESCE, coalesce_max=8)
+    loop = asyncio.new_event_loop()
+    try:
+        subscription = dl.AsyncSubscription(lambda batch: None, loop, batch_size=1, queue_limits=limits)
+        for i in range(1000):
+            subscription._put([_utterance(i)])
+    finally:
+        loop.close()
+
+    retained = sum(len(item) for item in subscription.items)
+    assert len(subscription.items) == 4
+    assert retained <= 4 * 8
+    assert subscription.dropped == 1000 - retained
+
+def test_on_drop_receives_evicted_items():
+    evicted = []
+    queue = bq.BoundedQueue("test", maxsize=2, policy=bq.DROP_OLDEST, on_drop=evicted.append)
+    for i in range(5):
+        queue.put_nowait(i)
+
+    assert evicted == [0, 1, 2]
+    assert [queue.get_nowait(), queue.get_nowait()] == [3, 4]
+
+def test_thread_subscription_stops_after_overflow_during_close():
+    # Сигнал остановки не хранится в очереди, поэтому переполнение после close() его не вытесняет
+    received = []
+    release = threading.Event()
+
+    def callback(batch):
+        release.wait(timeout=5)
+        received.extend(batch)
+
+    subscription = dl.ThreadSubscription(callback, batch_size=1, queue_limits=dict(maxsize=2, policy=bq.DROP_OLDEST))
+    subscription.start()
+    subscription.put([_utterance(0)]) # Поток подписчика занят этим пакетом
+    while subscription.queue.qsize():
+        time.sleep(0.01)
+    thread = subscription._thread
+    subscription.queue.close()
+    for i in range(1, 6):
+        subscription.put([_utterance(i)])
+    release.set()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert [u.utterance_id for u in received] == [0, 4, 5]
+
+def test_async_subscription_stops_after_overflow_during_close():
+    received = []
+    limits = dict(maxsize=2, policy=bq.DROP_OLDEST)
+
+    async def main():
+        subscription = dl.AsyncSubscription(received.extend, asyncio.get_running_loop(), batch_size=1, queue_limits=limits)
+        subscription._close()
+        for i in range(5):
+            subscription._put([_utterance(i)])
+        await asyncio.wait_for(subscription._run(), timeout=5)
+
+    asyncio.run(main())
+    assert [u.utterance_id for u in received] == [3, 4]
+
+def _dropped_total(name):
+    samples = mt.snapshot()["stt_queue_dropped_total"]["samples"]
+    return sum(s["value"] for s in samples if s["labels"] == {"queue": name})
+
+def test_dropped_counter_survives_queue_removal():
+    # Счётчик потерь не уменьшается, когда очередь удалена сборщиком мусора
+    before = _dropped_total("gc-test")
+    queue = bq.BoundedQueue("gc-test", maxsize=1, policy=bq.DROP_NEWEST)
+    for i in range(3):
+        queue.put_nowait(i)
+    del queue
+    gc.collect()
+    assert _dropped_total("gc-test") == before + 2
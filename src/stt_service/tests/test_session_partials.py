@@ -0,0 +1,76 @@
+import types
+import pytest
+import numpy as np
+import config as cfg
+import utterance as ut
+
+wr = pytest.importorskip("whisper") # Нужны faster_whisper, torch и sounddevice
+dc = pytest.importorskip("decoder")
+
+class _Publisher:
+    def __init__(self):
+        self.utterances = []
+        self.updates = []
+
+    def publish(self, utterance):
+        self.utterances.append(utterance)
+
+    def publish_update(self, update):
+        self.updates.append(update)
+
+class _Engine:
+    def new_vad(self):
+        return None
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(cfg, "PARTIALS_ENABLE", True)
+    return wr.STTSession(_Engine(), _Publisher(), "test")
+
+def _segment(session, utterance_id, is_partial):
+    return wr.SpeechSegment(np.zeros(160, dtype=np.float32), 0, 160, session,
+                            utterance_id=utterance_id, is_partial=is_partial)
+
+def _send_partial(session, utterance_id):
+    session._open_utterance = utterance_id
+    session.deliver(_segment(session, utterance_id, True), dc.DecodeResult("привет", -0.1, 0.0))
+    session._open_utterance = None # VAD закрыл реплику
+
+def test_empty_final_clears_partial(session):
+    _send_partial(session, 1)
+    session.deliver(_segment(session, 1, False), dc.DecodeResult("", 0.0, 0.9))
+
+    assert session.publisher.utterances == []
+    assert session.publisher.updates == [ut.TranscriptUpdate("test", 1, "привет", False),
+                                         ut.TranscriptUpdate("test", 1, "", True)]
+
+def test_dropped_segment_clears_partial(session):
+    _send_partial(session, 2)
+    session._close_partials(2) # Путь вытеснения из буфера / отказа очереди декодирования
+
+    assert session.publisher.updates[-1] == ut.TranscriptUpdate("test", 2, "", True)
+
+def test_empty_final_without_partial_publishes_nothing(session):
+    session.deliver(_segment(session, 3, False), dc.DecodeResult("", 0.0, 0.9))
+
+    assert session.publisher.updates == []
+
+def test_partial_skipped_after_vad_reset(session):
+    # После переполнения буфера VAD сброшен (speech_start = None), а реплика ещё открыта
+    session.vad = types.SimpleNamespace(position=cfg.SAMPLE_RATE * 10, speech_start=None)
+    session._open_utterance = 4
+    session._submit_partial()
+
+    assert not session._partial_in_flight
+
+def test_evicted_segments_are_accounted(session):
+    _send_partial(session, 5)
+    session.finals_submitted += 1
+    session.segment_dropped(_segment(session, 5, False))
+
+    assert session.finals_dropped == 1
+    assert session.publisher.updates[-1] == ut.TranscriptUpdate("test", 5, "", True)
+
+    session._partial_in_flight = True
+    session.segment_dropped(_segment(session, 6, True))
+    assert not session._partial_in_flight
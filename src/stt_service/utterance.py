@@ -0,0 +1,71 @@
+from typing import NamedTuple
+import config as cfg
+import datetime
+import json
+
+# Распознанная реплика в виде компактной записи вместо строки "[HH:MM:SS] текст".
+# Времена - абсолютные номера сэмплов в потоке сессии (частота cfg.SAMPLE_RATE),
+# поэтому запись однозначно привязана к аудио и не зависит от часов издателя.
+
+class Utterance(NamedTuple):
+    stream_id: str
+    utterance_id: int # Номер реплики в сессии (совпадает с TranscriptUpdate.utterance_id)
+    start: int # Абсолютные номера сэмплов начала и конца речи
+    end: int
+    text: str
+    avg_logprob: float
+    decode_latency: float # Секунд от передачи сегмента в декодер до готового текста
+    published_at: float # time.time() публикации
+    segments: tuple = () # Сегменты Whisper: (start, end, text), start/end - абсолютные сэмплы
+    words: tuple = () # Слова (при DECODE_WORD_TIMESTAMPS): (start, end, word, probability)
+
+    @property
+    def start_sec(self):
+        return self.start / cfg.SAMPLE_RATE
+
+    @property
+    def end_sec(self):
+        return self.end / cfg.SAMPLE_RATE
+
+    def __str__(self):
+        # Прежний текстовый вид для подписчиков, которые просто выводят реплики
+        return datetime.datetime.fromtimestamp(self.published_at).strftime("[%H:%M:%S]") + " " + self.text
+
+    def to_dict(self):
+        # Для клиентов JSON: времена в секундах
+        return {
+            "stream_id": self.stream_id,
+            "utterance_id": self.utterance_id,
+            "start": self.start_sec,
+            "end": self.end_sec,
+            "text": self.text,
+            "avg_logprob": self.avg_logprob,
+            "decode_latency": self.decode_latency,
+            "published_at": self.published_at,
+            "segments": [[s / cfg.SAMPLE_RATE, e / cfg.SAMPLE_RATE, text] for s, e, text in self.segments],
+            "words": [[s / cfg.SAMPLE_RATE, e / cfg.SAMPLE_RATE, word, p] for s, e, word, p in self.words],
+        }
+
+    def to_json(self):
+        # Компактная сериализация: запись - это кортеж, поэтому в JSON она становится массивом полей по порядку
+        return json.dumps(self, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_wire(cls, fields):
+        fields = list(fields)
+        if len(fields) > 8:
+            fields[8] = tuple(tuple(segment) for segment in fields[8])
+        if len(fields) > 9:
+            fields[9] = tuple(tuple(word) for word in fields[9])
+        return cls(*fields)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_wire(json.loads(data))
+
+class TranscriptUpdate(NamedTuple):
+    # Обновление для подписчиков промежуточных результатов: partial заменяется финалом с тем же utterance_id
+    stream_id: str
+    utterance_id: int
+    text: str
+    is_final: bool
@@ -0,0 +1,169 @@
+import metrics as mt
+import config as cfg
+import numpy as np
+import logging
+import torch
+
+_WINDOWS = mt.counter("stt_vad_windows_total", "Окон аудио, оценённых VAD")
+_SAMPLES_LOST = mt.counter("stt_vad_samples_lost_total", "Сэмплов, вытесненных из кольцевого буфера до обработки VAD")
+_WINDOWS_SKIPPED = mt.counter("stt_vad_windows_skipped_total", "Окон, отброшенных энергетическим фильтром без запуска Silero")
+
+class EnergyGate:
+    # Дешёвый фильтр перед Silero: окна, энергия которых не выше адаптивного уровня шума
+    # больше чем на margin_db, считаются тишиной без запуска нейросети. Уровень шума быстро
+    # опускается к тихим окнам и медленно поднимается (ровный фон, музыка на удержании становятся "полом").
+
+    def __init__(self, margin_db=cfg.VAD_GATE_MARGIN_DB, floor_rise=cfg.VAD_GATE_FLOOR_RISE,
+                 floor_fall=cfg.VAD_GATE_FLOOR_FALL, min_db=cfg.VAD_GATE_MIN_DB):
+        self.margin_db = margin_db
+        self.floor_rise = floor_rise # Доля разницы, на которую уровень шума поднимается за окно
+        self.floor_fall = floor_fall # ...и опускается
+        self.min_db = min_db
+        self.floor_db = min_db # Начинаем с цифровой тишины: пока уровень шума не оценён, всё проверяет Silero
+
+    def energies_db(self, windows):
+        # windows: (окна, сэмплы); средняя мощность каждого окна в dBFS одним векторным вызовом
+        power = np.einsum('ij,ij->i', windows, windows) / windows.shape[1]
+        return 10.0 * np.log10(np.maximum(power, 10.0 ** (self.min_db / 10.0)))
+
+    def is_silence(self, energy_db):
+        silence = energy_db < self.floor_db + self.margin_db
+
+        rate = self.floor_fall if energy_db < self.floor_db else self.floor_rise
+        self.floor_db += (energy_db - self.floor_db) * rate
+        return silence
+
+class StreamingVAD:
+    # Потоковый Silero VAD: каждое окно оценивается ровно один раз, состояние модели
+    # и гистерезис речь/тишина сохраняются между вызовами process().
+    # События - словари в формате silero: {'start': n} при начале речи и
+    # {'start': n, 'end': m} для завершённого сегмента (n, m - абсолютные номера сэмплов),
+    # {'abort': n} - начатый сегмент потерян (аудио вытеснено из буфера до обработки), конца у него не будет.
+
+    def __init__(self, model, sampling_rate=cfg.SAMPLE_RATE, threshold=0.5, min_silence_duration_ms=100,
+                 speech_pad_ms=30, min_speech_duration_ms=250, max_speech_duration_s=cfg.VAD_MAX_SEGMENT_SEC):
+        if sampling_rate not in (8000, 16000):
+            raise ValueError("Silero VAD поддерживает только частоты 8000 и 16000 Гц.")
+
+        self.model = model
+        self.sampling_rate = sampling_rate
+        self.window_size = 512 if sampling_rate == 16000 else 256
+        self.threshold = threshold
+        self.neg_threshold = max(threshold - 0.15, 0.01) # Порог выхода из речи ниже порога входа (гистерезис)
+        self.min_silence_samples = int(sampling_rate * min_silence_duration_ms / 1000)
+        self.speech_pad_samples = int(sampling_rate * speech_pad_ms / 1000)
+        self.min_speech_samples = int(sampling_rate * min_speech_duration_ms / 1000)
+        self.max_speech_samples = int(sampling_rate * max_speech_duration_s)
+
+        self.windows_processed = 0
+        self.windows_skipped = 0 # Окна, которые энергетический фильтр пропустил без Silero
+        self.samples_lost = 0 # Аудио, вытесненное из кольцевого буфера до обработки VAD
+        self.gate = EnergyGate() if cfg.VAD_GATE_ENABLE else None
+        self.reset()
+
+    @property
+    def skip_ratio(self):
+        return self.windows_skipped / self.windows_processed if self.windows_processed else 0.0
+
+    def reset(self, position=0):
+        self.model.reset_states()
+        self._model_fresh = True # Состояние Silero сброшено и ещё не видело аудио
+        self.position = position # Абсолютная позиция начала следующего окна
+        self.triggered = False
+        self.speech_start = None
+        self.start_emitted = False
+        self.temp_end = 0
+
+    def process(self, ring):
+        events = []
+
+        if not ring.is_valid(self.position):
+            logging.warning("VAD: кольцевой буфер переполнен, часть аудио пропущена.")
+            self.samples_lost += ring.start - self.position
+            _SAMPLES_LOST.inc(ring.start - self.position)
+            if self.start_emitted: # Подписчики уже знают о начале реплики - сообщаем, что она оборвана
+                events.append({'abort': self.speech_start})
+            self.reset(ring.start)
+
+        count = (ring.end - self.position) // self.window_size
+        if count <= 0:
+            return events
+
+        # Все новые окна - одним непрерывным представлением буфера без копирования
+        block = ring.view(self.position, self.position + count * self.window_size).reshape(count, self.window_size)
+        energies = self.gate.energies_db(block) if self.gate is not None else None
+        skipped = 0
+
+        for i in range(count):
+            window_start = self.position
+
+            # Во время речи решения принимает только Silero; фильтр отсекает лишь тишину вне речи.
+            # Сначала проверяем triggered: уровень шума не должен подстраиваться под окна речи
+            if not self.triggered and energies is not None and self.gate.is_silence(energies[i]):
+                speech_prob = 0.0
+                skipped += 1
+                if not self._model_fresh: # После пропуска окон контекст Silero устарел
+                    self.model.reset_states()
+                    self._model_fresh = True
+            else:
+                with torch.no_grad():
+                    speech_prob = self.model(torch.from_numpy(block[i]), self.sampling_rate).item()
+                self._model_fresh = False
+
+            self.position += self.window_size
+            self.windows_processed += 1
+            self._update(speech_prob, window_start, events)
+
+        self.windows_skipped += skipped
+        _WINDOWS.inc(count)
+        if skipped:
+            _WINDOWS_SKIPPED.inc(skipped)
+        return events
+
+    def flush(self):
+        # Закрывает открытый сегмент (например, в конце файла)
+        events = []
+        if self.triggered:
+            self._close_segment(self.position, events)
+        return events
+
+    def _update(self, speech_prob, window_start, events):
+        window_end = self.position
+
+        if speech_prob >= self.threshold:
+            self.temp_end = 0
+            if not self.triggered:
+                self.triggered = True
+                self.start_emitted = False
+                self.speech_start = max(0, window_start - self.speech_pad_samples)
+
+        elif speech_prob < self.neg_threshold and self.triggered:
+            if not self.temp_end:
+                self.temp_end = window_end
+            if window_end - self.temp_end >= self.min_silence_samples:
+                self._close_segment(min(self.temp_end + self.speech_pad_samples, window_end), events)
+                return
+
+        if not self.triggered:
+            return
+
+        # Начало речи сообщаем, только когда она длится дольше min_speech_duration_ms
+        if not self.start_emitted and window_end - self.speech_start >= self.min_speech_samples:
+            self.start_emitted = True
+            events.append({'start': self.speech_start})
+
+        # Слишком длинную речь режем, чтобы сегмент помещался в окно Whisper и в кольцевой буфер
+        if window_end - self.speech_start >= self.max_speech_samples:
+            self._close_segment(window_end, events)
+            self.triggered = True
+            self.start_emitted = True
+            self.speech_start = window_end
+            events.append({'start': self.speech_start})
+
+    def _close_segment(self, speech_end, events):
+        if self.start_emitted:
+            events.append({'start': self.speech_start, 'end': speech_end})
+        self.triggered = False
+        self.start_emitted = False
+        self.speech_start = None
+        self.temp_end = 0
@@ -1,7 +1,12 @@
+import resampler as rs
 import config as cfg
 import numpy as np
+import hashlib
 import logging
 import torch
+import json
+import time
+import os
 
 def tts_init():
     try:
@@ -47,16 +52,71 @@ def generate_audio_data(tts_model):
     logging.info("Аудио для прогрева сгенерировано.")
     return audio_data
 
-def warmup_models(whisper_model, vad_model, timestamps_func):
+def resample_audio(audio_data, source_rate, target_rate):
+    return rs.resample(audio_data, source_rate, target_rate)
+
+def warmup_cache_path():
+    # Ключ кэша - всё, от чего зависит синтезированный сигнал, плюс версия формата кэша
+    key_fields = dict(
+        version=cfg.WARMUP_CACHE_VERSION,
+        repo=cfg.TTS_SILERO_REPO,
+        model=cfg.TTS_SILERO_MODEL,
+        model_version=cfg.TTS_MODEL_VERSION,
+        language=cfg.LANGUAGE,
+        speaker=cfg.TTS_SPEAKER,
+        num_speakers=cfg.TTS_NUM_SPEAKERS,
+        text=cfg.TTS_WARMUP_TEXT,
+        tts_sample_rate=cfg.TTS_SAMPLE_RATE,
+        sample_rate=cfg.SAMPLE_RATE)
+    key = hashlib.sha256(json.dumps(key_fields, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cfg.WARMUP_CACHE_DIR, f"warmup_v{cfg.WARMUP_CACHE_VERSION}_{key}.npy")
+
+def load_warmup_audio():
+    # Аудио для прогрева берётся из кэша на диске; Silero TTS загружается только при промахе
+    cache_path = warmup_cache_path()
+    if os.path.exists(cache_path):
+        try:
+            audio_data = np.load(cache_path)
+            logging.debug(f"Аудио для прогрева загружено из кэша '{cache_path}'.")
+            return audio_data
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать кэш прогрева '{cache_path}': {e}. Аудио будет сгенерировано заново.")
+
+    tts_model = tts_init()
+    # TTS синтезирует с частотой TTS_SAMPLE_RATE, а модели ждут SAMPLE_RATE
+    audio_data = resample_audio(generate_audio_data(tts_model), cfg.TTS_SAMPLE_RATE, cfg.SAMPLE_RATE)
+
+    if not np.any(audio_data): # Тишина-заглушка после ошибок синтеза - не кэшируем, попробуем в следующий раз
+        return audio_data
+
+    try:
+        os.makedirs(cfg.WARMUP_CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path + ".tmp.npy"
+        np.save(tmp_path, audio_data)
+        os.replace(tmp_path, cache_path) # Атомарно: параллельный запуск не прочитает недописанный файл
+        logging.debug(f"Аудио для прогрева сохранено в кэш '{cache_path}'.")
+    except OSError as e:
+        logging.warning(f"Не удалось сохранить кэш прогрева '{cache_path}': {e}.")
+
+    return audio_data
+
+def warmup_models(whisper_model, vad_model, timestamps_func, batch_decoder=None, timings=None):
     try:
         logging.info("Прогрев моделей Whisper и Silero VAD...") 
-        tts_model = tts_init()
-        warmup_audio_data = generate_audio_data(tts_model)
+        phase_start = time.perf_counter()
+        warmup_audio_data = load_warmup_audio()
+        if timings is not None:
+            timings["warmup_audio"] = time.perf_counter() - phase_start
 
+        phase_start = time.perf_counter()
         for i in range(cfg.NUM_WARMUP_RUNS):
             _ = whisper_model.transcribe(warmup_audio_data, language=cfg.LANGUAGE)
             _ = timestamps_func(warmup_audio_data, vad_model, sampling_rate=cfg.SAMPLE_RATE, **cfg.VAD_PARAMETERS)
+            if batch_decoder is not None: # Пакетный путь - тот, которым декодируются сегменты
+                _ = batch_decoder.decode([warmup_audio_data[:batch_decoder.max_samples]])
             logging.debug(f"Прогрев: запуск {i+1}/{cfg.NUM_WARMUP_RUNS} завершен.")
+        if timings is not None:
+            timings["warmup_runs"] = time.perf_counter() - phase_start
 
         logging.info("Прогрев моделей завершен.")
 
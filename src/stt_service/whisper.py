@@ -1,40 +1,128 @@
 import sounddevice as sd
 import faster_whisper
+import bounded_queue as bq
+import metrics as mt
+import ring_buffer as rb
+import resampler as rs
 import config as cfg
+import vad as vd
+import decoder as dc
 import warmup as wp
+import autotune as at
+import utterance as ut
 import numpy as np
-import datetime
+import concurrent.futures
+import itertools
+import threading
 import logging
 import torch
 import queue
 import time
-import sys
+import json
+import copy
+from typing import NamedTuple
+
+_STAGE_SECONDS = mt.histogram("stt_stage_seconds", "Длительность стадий STT", ("stage",))
+_VAD_SECONDS = _STAGE_SECONDS.labels("vad") # Один проход VAD по новым окнам буфера
+_QUEUE_WAIT = _STAGE_SECONDS.labels("queue_wait") # От конца речи (постановки в очередь) до начала декодирования
+_DECODE_SECONDS = _STAGE_SECONDS.labels("decode") # Декодирование пакета
+_END_TO_END = _STAGE_SECONDS.labels("end_to_end") # От записи в буфер последнего сэмпла речи до публикации реплики
+_SEGMENTS = mt.counter("stt_segments_total", "Декодировано сегментов", ("kind",))
+_AUDIO_SECONDS = mt.counter("stt_audio_decoded_seconds_total", "Секунд аудио, прошедших через декодер", ("kind",))
+_RTF = mt.histogram("stt_decode_rtf", "Real-time factor пакета: время декодирования / длительность аудио", ("kind",), buckets=mt.RATIO_BUCKETS)
+_BATCH_SIZE = mt.histogram("stt_decode_batch_size", "Сегментов в пакете декодирования", buckets=mt.SIZE_BUCKETS)
+_DECODE_ERRORS = mt.counter("stt_decode_errors_total", "Пакетов, декодирование которых завершилось ошибкой")
+_SESSIONS = mt.gauge("stt_sessions", "Открытых сессий STT")
+
+class SpeechSegment(NamedTuple):
+    audio: np.ndarray
+    start: int # Абсолютные номера сэмплов в потоке сессии
+    end: int
+    session: object # Сессия-источник, которой вернётся результат
+    utterance_id: int = 0 # Номер реплики в сессии (общий у промежуточных и финального результата)
+    is_partial: bool = False # Промежуточная гипотеза по ещё не завершённой реплике
+    created_at: float = 0.0 # time.monotonic() постановки в очередь - для оценки возраста сегмента
+    captured_at: float = 0.0 # time.monotonic() поступления в буфер последнего сэмпла сегмента
+
+def _coalesce_segments(last, new):
+    # Более свежая гипотеза той же сессии заменяет ещё не декодированную старую
+    if last.is_partial and new.is_partial and last.session is new.session:
+        return new
+    return None
+
+class STTEngine:
+    # Модели загружаются один раз на процесс. Движок открывает сколько угодно независимых
+    # сессий (STTSession), а декодирование сегментов всех сессий выполняют общие потоки.
+
+    def __init__(self):
+        self.whisper_model = None
+        self.batch_decoder = None
+        self.profile_controller = dc.DecodeProfileController() # Профиль декодирования по нагрузке
+        self.silero_vad_model = None
+        self.get_speech_timestamps = None # Указатель на функцию VAD утилиты (используется при прогреве)
+
+        self.decode_queue = bq.BoundedQueue("decode", coalesce=_coalesce_segments, on_drop=self._segment_dropped,
+                                            **cfg.QUEUE_LIMITS["decode"])
+        self._decode_threads = []
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._session_ids = itertools.count(1)
+        self.is_running = False
+        self.ready = threading.Event() # Установлено, когда модели загружены и прогреты
+        self.startup_timings = {} # Длительность фаз запуска в секундах
+
+    def load(self):
+        # VAD и Whisper загружаются параллельно; прогрев (WARMUP_IN_BACKGROUND) может идти уже
+        # после запуска сессий - сегменты до его окончания копятся в очереди декодирования
+        logging.info("Инициализация моделей...")
+        load_start = time.perf_counter()
+        self.startup_timings = {}
+
+        device_type = cfg.DEVICE
+        if cfg.DEVICE == "auto":
+            device_type = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+        if device_type == "cpu":
+            try: # Подобранные для этой машины COMPUTE_TYPE / CPU_THREADS / NUM_WORKERS / DECODE_WORKERS
+                self._timed("autotune", at.tune)
+            except Exception as e:
+                logging.warning(f"Autotune: {e}. Используются настройки из config.")
+
+        comp_type = cfg.COMPUTE_TYPE
+        if comp_type == "auto":
+            comp_type = "int8" if device_type == "cpu" else "float32"
 
-audio_queue = queue.Queue()
-
-is_running = True
-whisper_model = None
-silero_vad_model = None
-get_speech_timestamps = None # Указатель на функцию VAD утилиты
-processed_audio_index = 0 # Индекс в буфере, до которого аудио уже было обработано VAD
-
-def init_transcribe():
-    logging.info("Инициализация моделей...")
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="STTLoad") as executor:
+                vad_future = executor.submit(self._timed, "vad_load", self._load_vad, device_type)
+                whisper_future = executor.submit(self._timed, "whisper_load", self._load_whisper, device_type, comp_type)
+                vad_future.result()
+                whisper_future.result()
+            self.startup_timings["models_loaded"] = time.perf_counter() - load_start
+            logging.info("Инициализация завершена.")
+
+            if not cfg.WARMUP_ENABLE:
+                self._set_ready(load_start)
+            elif cfg.WARMUP_IN_BACKGROUND:
+                thread = threading.Thread(target=self._warmup, args=(load_start,), name="STTWarmup")
+                thread.daemon = True
+                thread.start()
+            elif not self._warmup(load_start):
+                return False
 
-    device_type = cfg.DEVICE
-    comp_type = cfg.COMPUTE_TYPE
+        except Exception as e:
+            logging.error(f"Ошибка на этапе загрузки или прогрева моделей: {e}.")
+            return False
 
-    if cfg.DEVICE == "auto":
-        if torch.cuda.is_available():
-            device_type = "cuda:0"
-            comp_type = "float32"
-        else:
-            device_type = "cpu"
-            comp_type = "int8"
+        return True
 
-    global whisper_model, silero_vad_model, get_speech_timestamps
+    def _timed(self, phase, func, *args):
+        phase_start = time.perf_counter()
+        result = func(*args)
+        self.startup_timings[phase] = time.perf_counter() - phase_start
+        return result
 
-    try:
+    def _load_vad(self, device_type):
         logging.debug("Загрузка модели Silero VAD...")
         silero_vad_model, vad_utils = torch.hub.load(
             repo_or_dir=cfg.SILERO_VAD_REPO,
@@ -42,160 +130,460 @@ def init_transcribe():
             force_reload=False # Не перезагружать при каждом запуске
         )
         # Извлекаем нужную функцию для получения временных меток сегментов
-        (get_speech_timestamps, _, _, _, _) = vad_utils
-        silero_vad_model = silero_vad_model.to(device_type)
+        (self.get_speech_timestamps, _, _, _, _) = vad_utils
+        self.silero_vad_model = silero_vad_model.to(device_type)
         logging.debug(f"Модель Silero VAD '{cfg.SILERO_VAD_MODEL}' загружена на {device_type}.")
 
+    def _load_whisper(self, device_type, comp_type):
         logging.debug(f"Загрузка модели Whisper '{cfg.MODEL_SIZE}'...")
-        whisper_model = faster_whisper.WhisperModel(
-            cfg.MODEL_SIZE, 
-            device=device_type, 
-            compute_type=comp_type, 
-            cpu_threads=cfg.CPU_THREADS, 
+        self.whisper_model = faster_whisper.WhisperModel(
+            cfg.MODEL_SIZE,
+            device=device_type,
+            compute_type=comp_type,
+            cpu_threads=cfg.CPU_THREADS,
             num_workers=cfg.NUM_WORKERS)
+        self.batch_decoder = dc.BatchDecoder(self.whisper_model)
         logging.debug(f"Модель Whisper '{cfg.MODEL_SIZE}' загружена на {device_type} ({comp_type}).")
-        logging.info("Инициализация завершена.") 
-
-        if cfg.WARMUP_ENABLE:  
-            wp.warmup_models(whisper_model, silero_vad_model, get_speech_timestamps)
-
-    except Exception as e:
-        logging.error(f"Ошибка на этапе загрузки или прогрева моделей: {e}.")
-        return False
-     
-    return True
-
-def audio_callback(indata, frames, time, status):
-    if status:
-        logging.warning(status, file=sys.stderr)
-    audio_queue.put(indata.copy())
-
-def transcribe_audio(publisher):
 
-    global is_running, processed_audio_index
-    accumulated_audio = np.array([], dtype=np.float32) # Буфер для накопления аудио
-
-    logging.info(f"\nНачинаю слушать микрофон (частота: {cfg.SAMPLE_RATE} Гц)...")
+    def _warmup(self, load_start):
+        try:
+            # Прогреваем на копии VAD, чтобы не трогать состояние модели, которую копируют сессии
+            self._timed("warmup", wp.warmup_models, self.whisper_model, copy.deepcopy(self.silero_vad_model),
+                        self.get_speech_timestamps, self.batch_decoder, self.startup_timings)
+        except Exception as e:
+            logging.error(f"Ошибка на этапе прогрева моделей: {e}.")
+            # Модели загружены и без прогрева работоспособны - не блокируем декодирование
+            self._set_ready(load_start)
+            return False
 
-    try:
-        stream = sd.InputStream(
-            samplerate=cfg.SAMPLE_RATE,
-            blocksize=cfg.BLOCK_SIZE,
-            channels=cfg.CHANNELS, 
-            dtype='float32',      
-            callback=audio_callback 
-        )
-        stream.start()
-    except Exception as e:
-        logging.error(f"Ошибка при открытии аудиопотока: {e}\n"+
-                      "Убедитесь, что у вас выбран правильный микрофон по умолчанию и он работает.")
-        is_running = False
+        self._set_ready(load_start)
+        return True
+
+    def _set_ready(self, load_start):
+        self.startup_timings["ready"] = time.perf_counter() - load_start
+        self.ready.set()
+        timings = {phase: round(seconds, 3) for phase, seconds in self.startup_timings.items()}
+        logging.info(f"STTEngine: время запуска {json.dumps(timings)}")
+
+    def start(self):
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self.decode_queue.reopen()
+        if cfg.METRICS_PORT:
+            mt.start_http_server()
+        for i in range(cfg.DECODE_WORKERS):
+            thread = threading.Thread(target=self._decode_worker, name=f"STTDecoder-{i}")
+            thread.daemon = True
+            thread.start()
+            self._decode_threads.append(thread)
+        logging.debug(f"STTEngine: запущено потоков декодирования: {cfg.DECODE_WORKERS}.")
+
+    def stop(self):
+        if not self.is_running:
+            return
+
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.stop()
+
+        self.is_running = False
+        # Даём декодерам дообработать очередь и останавливаем их
+        self.decode_queue.close()
+        for thread in self._decode_threads:
+            thread.join(timeout=30)
+            if thread.is_alive():
+                logging.warning(f"STTEngine: поток {thread.name} не завершился вовремя.")
+        self._decode_threads = []
+        logging.debug("STTEngine: остановлен.")
+
+    def open_session(self, publisher, stream_id=None, use_microphone=False, sample_rate=cfg.SAMPLE_RATE, channels=1):
+        if self.whisper_model is None:
+            raise RuntimeError("STTEngine: модели не загружены, вызовите load().")
+
+        if stream_id is None:
+            stream_id = f"stream-{next(self._session_ids)}"
+
+        session = STTSession(self, publisher, stream_id, use_microphone=use_microphone, sample_rate=sample_rate, channels=channels)
+        with self._sessions_lock:
+            self._sessions.append(session)
+            _SESSIONS.set(len(self._sessions))
+        logging.debug(f"STTEngine: открыта сессия '{stream_id}'.")
+        return session
+
+    def close_session(self, session):
+        with self._sessions_lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            _SESSIONS.set(len(self._sessions))
+        logging.debug(f"STTEngine: сессия '{session.stream_id}' закрыта.")
+
+    def sessions(self):
+        with self._sessions_lock:
+            return list(self._sessions)
+
+    def new_vad(self):
+        # У Silero VAD внутреннее состояние хранится в самой модели, поэтому каждой сессии - своя копия
+        return vd.StreamingVAD(copy.deepcopy(self.silero_vad_model), sampling_rate=cfg.SAMPLE_RATE, **cfg.VAD_PARAMETERS)
+
+    def submit(self, segment):
+        # Блокирующая постановка в ограниченную очередь, прерываемая остановкой сессии или движка
+        while self.is_running and segment.session.is_running:
+            try:
+                if not self.decode_queue.put(segment, timeout=0.5):
+                    logging.warning(f"STTEngine: очередь декодирования переполнена, сегмент сессии '{segment.session.stream_id}' отброшен.")
+                    return False
+                return True
+            except queue.Full:
+                logging.debug("STTEngine: очередь декодирования заполнена, VAD ожидает.")
         return False
 
-    last_vad_process_time = time.time()
+    def _segment_dropped(self, segment):
+        # Сегмент вытеснен из очереди декодирования (политики drop_oldest/coalesce) и до deliver() не дойдёт
+        if segment is not None:
+            segment.session.segment_dropped(segment)
 
-    while is_running:
-        try:
-            while not audio_queue.empty():
-                new_data = audio_queue.get_nowait()
-                accumulated_audio = np.concatenate((accumulated_audio, new_data.flatten()))
-
-            current_time = time.time()
-            buffer_duration = len(accumulated_audio) / cfg.SAMPLE_RATE
-            unprocessed_duration = (len(accumulated_audio) - processed_audio_index) / cfg.SAMPLE_RATE
-
-            # Проверяем буфер VAD, если прошло достаточно времени ИЛИ накопилось много необработанных данных
-            if unprocessed_duration >= cfg.VAD_PROCESS_INTERVAL_SEC or \
-                (buffer_duration > 0 and current_time - last_vad_process_time > cfg.VAD_PROCESS_INTERVAL_SEC * 2): # Форсировать VAD, если буфер долго не обрабатывался
-
-                # Выделяем только ту часть буфера, которую еще не обрабатывали VAD
-                current_chunk_for_vad = accumulated_audio[processed_audio_index:]
-                chunk_duration = len(current_chunk_for_vad) / cfg.SAMPLE_RATE
-
-                if chunk_duration > 0: 
-                    audio_tensor_chunk = torch.from_numpy(current_chunk_for_vad).unsqueeze(0)
-
-                    # Используем Silero VAD для поиска сегментов в текущем чанке
-                    with torch.no_grad(): 
-                        timestamps = get_speech_timestamps(
-                            audio_tensor_chunk,
-                            silero_vad_model,
-                            sampling_rate=cfg.SAMPLE_RATE,
-                            **cfg.VAD_PARAMETERS
-                        )
-
-                    last_vad_process_time = current_time 
-
-                    # Проходимся по сегментам, найденным VAD в ТЕКУЩЕМ чанке
-                    if timestamps:
-                        full_text_this_cycle = ""
-                        now = datetime.datetime.now()
-                        timestamp_str = now.strftime("[%H:%M:%S]")
-
-                        for i, ts in enumerate(timestamps):
-                            start_sample_chunk = ts['start']
-                            end_sample_chunk = ts['end']
-
-                            start_sample_abs = processed_audio_index + start_sample_chunk
-                            end_sample_abs = processed_audio_index + end_sample_chunk
-
-                            segment_audio = accumulated_audio[start_sample_abs:end_sample_abs]
-
-                            if len(segment_audio) > 0:
-                                # Транскрибируем ТОЛЬКО этот сегмент с помощью Whisper
-                                try:
-                                    segment_segments_whisper, segment_info = whisper_model.transcribe(
-                                        segment_audio,
-                                        language=cfg.LANGUAGE,
-                                        beam_size=5,
-                                        task="transcribe",
-                                        vad_filter=False 
-                                    )
-
-                                    if segment_segments_whisper is not None:
-                                        for s_seg in segment_segments_whisper:
-                                             full_text_this_cycle += s_seg.text + " "
-
-                                except Exception as whisper_e:
-                                    logging.warning(f"\nОшибка при транскрипции сегмента Whisper: {whisper_e}")
-                                    # Продолжаем, чтобы не сломать весь цикл из-за одного сегмента
-
-                        full_text_this_cycle = full_text_this_cycle.strip()
-
-                        # Передвигаем указатель на конец последнего найденного в этом чанке сегмента
-                        if timestamps: 
-                           last_segment_end_in_chunk = timestamps[-1]['end'] 
-                           processed_audio_index += last_segment_end_in_chunk 
-
-                           lookahead_samples = int(cfg.SAMPLE_RATE * 0.1) 
-                           processed_audio_index = min(processed_audio_index + lookahead_samples, len(accumulated_audio))
-
-                        if full_text_this_cycle:
-                            publisher.publish(timestamp_str + " " + full_text_this_cycle)
-
-
-                if processed_audio_index > 0:
-                    accumulated_audio = accumulated_audio[processed_audio_index:]
-                    processed_audio_index = 0
-                    # print(f"Буфер очищен на {processed_audio_index} сэмплов. Осталось {len(accumulated_audio)} сэмплов.")
-
-            time.sleep(0.1)
-
-        except queue.Empty:
-            time.sleep(0.1)
-            continue
-        except KeyboardInterrupt:
-            logging.info("\nОстановка по требованию пользователя (Ctrl+C)...")
-            is_running = False
+    def try_submit(self, segment):
+        # Неблокирующая постановка: промежуточные гипотезы при занятом декодере просто пропускаются
+        # (и не вытесняют финальные сегменты при политиках drop_*)
+        if self.decode_queue.full():
             return False
-        except Exception as e:
-            logging.error(f"\nПроизошла ошибка в цикле транскрипции: {e}")
-            is_running = False
+        try:
+            return self.decode_queue.put_nowait(segment)
+        except queue.Full:
             return False
 
-    if 'stream' in locals() and stream.active:
-        stream.stop()
-        stream.close()
-        logging.info("Аудиопоток остановлен.")
+    def _collect_batch(self):
+        # Ждём первый сегмент, затем добираем готовые сегменты (из любых сессий),
+        # пока не наберётся DECODE_BATCH_SIZE или не истечёт DECODE_BATCH_MAX_WAIT_SEC
+        segment = self.decode_queue.get()
+        if segment is None:
+            return [], True
+
+        batch = [segment]
+        deadline = time.monotonic() + cfg.DECODE_BATCH_MAX_WAIT_SEC
+        while len(batch) < cfg.DECODE_BATCH_SIZE:
+            try:
+                segment = self.decode_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if segment is None: # Сигнал остановки: декодируем то, что уже набрали
+                return batch, True
+            batch.append(segment)
+
+        return batch, False
+
+    def _decode_worker(self):
+        # Стадия декодирования: собирает пакет сегментов, декодирует его одним вызовом
+        # и отправляет каждый текст обратно в сессию-источник
+        stop = False
+        while not stop:
+            batch, stop = self._collect_batch()
+            if not batch:
+                continue
+
+            self.ready.wait() # Пока идёт фоновый прогрев, сегменты ждут в очереди
+
+            # Финальные сегменты - профилем по текущей нагрузке, промежуточные - всегда дешёвым профилем
+            finals = [segment for segment in batch if not segment.is_partial]
+            partials = [segment for segment in batch if segment.is_partial]
+
+            decode_start = time.monotonic()
+            for segment in batch:
+                _QUEUE_WAIT.observe(decode_start - segment.created_at)
+            _BATCH_SIZE.observe(len(batch))
+
+            final_profile = self.profile_controller.name
+            if finals:
+                oldest_age = time.monotonic() - min(segment.created_at for segment in finals)
+                final_profile = self.profile_controller.update(self.decode_queue.qsize(), oldest_age)
+
+            for group, profile_name in ((finals, final_profile), (partials, cfg.PARTIAL_PROFILE)):
+                if not group:
+                    continue
+
+                kind = "partial" if group is partials else "final"
+                group_start = time.perf_counter()
+                try:
+                    results = self.batch_decoder.decode([segment.audio for segment in group], **cfg.DECODE_PROFILES[profile_name],
+                                                        word_timestamps=cfg.DECODE_WORD_TIMESTAMPS and group is finals)
+                except Exception as whisper_e:
+                    logging.warning(f"\nОшибка при пакетной транскрипции Whisper: {whisper_e}")
+                    results = [dc.DecodeResult("", 0.0, 0.0)] * len(group) # Не ломаем весь цикл из-за одного пакета
+                    _DECODE_ERRORS.inc()
+
+                elapsed = time.perf_counter() - group_start
+                audio_seconds = sum(len(segment.audio) for segment in group) / cfg.SAMPLE_RATE
+                _DECODE_SECONDS.observe(elapsed)
+                _SEGMENTS.labels(kind).inc(len(group))
+                _AUDIO_SECONDS.labels(kind).inc(audio_seconds)
+                _RTF.labels(kind).observe(elapsed / max(audio_seconds, 1e-9))
+
+                logging.debug(f"Декодирован пакет из {len(group)} сегментов (профиль '{profile_name}').")
+                for segment, result in zip(group, results):
+                    segment.session.deliver(segment, result)
+
+        logging.debug("Поток декодирования остановлен.")
+
+class STTSession:
+    # Один независимый аудиоисточник: свой кольцевой буфер, своё состояние VAD и свой издатель.
+    # Аудио подаётся колбеком микрофона или извне через feed().
+
+    def __init__(self, engine, publisher, stream_id, use_microphone=False, sample_rate=cfg.SAMPLE_RATE, channels=1):
+        self.engine = engine
+        self.publisher = publisher
+        self.stream_id = stream_id
+        self.use_microphone = use_microphone
+        self.sample_rate = sample_rate # Частота и число каналов входа; в буфер пишется моно SAMPLE_RATE
+        self.channels = channels
+        self.resampler = rs.StreamingResampler(sample_rate, cfg.SAMPLE_RATE, channels)
+        self._direct_input = self.resampler.passthrough and channels == 1 # Без преобразования - прямо в буфер
+
+        self.ring_buffer = rb.RingBuffer(int(cfg.SAMPLE_RATE * cfg.RING_BUFFER_SEC))
+        self.vad = engine.new_vad()
+
+        self.is_running = False
+        self._vad_thread = None
+        self._stream = None
+
+        self._utterance_ids = itertools.count(1)
+        self._open_utterance = None # Номер реплики, которая сейчас звучит (None - тишина)
+        self._last_partial_position = 0 # Позиция, на которой последний раз запрашивали промежуточный результат
+        self._partial_in_flight = False # Не ставим новую гипотезу, пока не декодирована предыдущая
+        self._partials_sent = set() # Реплики, по которым подписчикам ушла гипотеза, а финал ещё нет
+        self._partials_lock = threading.Lock() # Гипотеза не может прийти подписчику после финала той же реплики
+        self.finals_submitted = 0 # Финальных сегментов передано в декодер / возвращено из него
+        self.finals_delivered = 0
+        self.finals_dropped = 0 # Вытеснено из очереди декодирования
+
+    def start(self):
+        if self.is_running:
+            return True
+
+        self.vad.reset(self.ring_buffer.end)
+
+        if self.use_microphone:
+            logging.info(f"\nНачинаю слушать микрофон (частота: {self.sample_rate} Гц)...")
+            try:
+                self._stream = sd.InputStream(
+                    samplerate=self.sample_rate,
+                    blocksize=cfg.BLOCK_SIZE,
+                    channels=self.channels,
+                    dtype='float32',
+                    callback=self.audio_callback
+                )
+                self._stream.start()
+            except Exception as e:
+                logging.error(f"Ошибка при открытии аудиопотока: {e}\n"+
+                              "Убедитесь, что у вас выбран правильный микрофон по умолчанию и он работает.")
+                self._stream = None
+                return False
+
+        self.is_running = True
+        self._vad_thread = threading.Thread(target=self._vad_loop, name=f"STTVad-{self.stream_id}")
+        self._vad_thread.daemon = True
+        self._vad_thread.start()
+        return True
+
+    def stop(self):
+        # Идемпотентна: может вызываться и после аварийного завершения цикла VAD
+        self.is_running = False
+        self.ring_buffer.wake() # Будим стадию VAD, ожидающую новых данных
+
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+            logging.info("Аудиопоток остановлен.")
+
+        if self._vad_thread and self._vad_thread.is_alive() and self._vad_thread is not threading.current_thread():
+            self._vad_thread.join(timeout=10)
+            if self._vad_thread.is_alive():
+                logging.warning(f"Сессия '{self.stream_id}': поток VAD не завершился вовремя.")
+        self._vad_thread = None
+
+        # Реплика, оборванная остановкой, до декодера не дойдёт
+        if self._open_utterance is not None:
+            utterance_id, self._open_utterance = self._open_utterance, None
+            self._close_partials(utterance_id)
+
+        logging.info(f"Сессия '{self.stream_id}': окон VAD {self.vad.windows_processed}, "
+                     f"из них без Silero {self.vad.skip_ratio:.1%}.")
+        self.engine.close_session(self)
+
+    def stats(self):
+        return {
+            "stream_id": self.stream_id,
+            "vad_windows": self.vad.windows_processed,
+            "vad_skip_ratio": round(self.vad.skip_ratio, 3), # Доля окон, отсечённых энергетическим фильтром без Silero
+            "samples_lost": self.vad.samples_lost,
+            "finals_submitted": self.finals_submitted,
+            "finals_delivered": self.finals_delivered,
+            "finals_dropped": self.finals_dropped,
+        }
+
+    def feed(self, samples):
+        # Подача аудио от внешнего источника (float32, sample_rate, channels - чередующиеся или (кадры, каналы))
+        if self._direct_input:
+            self.ring_buffer.write(samples)
+        else:
+            self.resampler.write_to(self.ring_buffer, samples)
 
-    return True
\ No newline at end of file
+    def audio_callback(self, indata, frames, time, status):
+        if status:
+            logging.warning(f"Аудиопоток: {status}")
+        if self._direct_input:
+            self.ring_buffer.write(indata[:, 0]) # Пишем без промежуточной копии блока
+        else:
+            self.resampler.write_to(self.ring_buffer, indata)
+
+    def deliver(self, segment, result):
+        if segment.is_partial:
+            self._partial_in_flight = False
+            with self._partials_lock:
+                # Финал уже отправлен в декодер - устаревшая гипотеза не должна его перетереть
+                if result.text and segment.utterance_id == self._open_utterance:
+                    self._partials_sent.add(segment.utterance_id)
+                    self.publisher.publish_update(ut.TranscriptUpdate(self.stream_id, segment.utterance_id, result.text, False))
+            return
+
+        self.finals_delivered += 1
+        if result.text:
+            utterance = self._make_utterance(segment, result)
+            _END_TO_END.observe(time.monotonic() - segment.captured_at)
+            self.publisher.publish(utterance)
+        self._close_partials(segment.utterance_id, result.text)
+
+    def segment_dropped(self, segment):
+        if segment.is_partial:
+            self._partial_in_flight = False # Иначе новые гипотезы этой сессии больше не ставились бы
+            return
+        self.finals_dropped += 1
+        logging.warning(f"Сессия '{self.stream_id}': сегмент вытеснен из очереди декодирования, реплика потеряна.")
+        self._close_partials(segment.utterance_id)
+
+    def _close_partials(self, utterance_id, text=""):
+        # Финальное обновление по реплике. Если по ней уже ушла гипотеза, финал отправляется всегда -
+        # с пустым текстом, когда сегмент распознан пустым, отброшен или вытеснен, - иначе гипотеза не заменится
+        if not cfg.PARTIALS_ENABLE:
+            return
+        with self._partials_lock:
+            had_partial = utterance_id in self._partials_sent
+            self._partials_sent.discard(utterance_id)
+            if text or had_partial:
+                self.publisher.publish_update(ut.TranscriptUpdate(self.stream_id, utterance_id, text, True))
+
+    def _make_utterance(self, segment, result):
+        # Времена Whisper (секунды от начала сегмента) переводим в абсолютные сэмплы потока
+        def to_samples(seconds):
+            return min(segment.end, segment.start + int(round(seconds * cfg.SAMPLE_RATE)))
+
+        return ut.Utterance(
+            stream_id=self.stream_id,
+            utterance_id=segment.utterance_id,
+            start=segment.start,
+            end=segment.end,
+            text=result.text,
+            avg_logprob=result.avg_logprob,
+            decode_latency=time.monotonic() - segment.created_at,
+            published_at=time.time(),
+            segments=tuple((to_samples(s), to_samples(e), text) for s, e, text in result.segments),
+            words=tuple((to_samples(s), to_samples(e), word, p) for s, e, word, p in result.words))
+
+    def _submit_partial(self):
+        # Повторно декодируем хвост открытой реплики не чаще раза в PARTIAL_INTERVAL_SEC
+        position = self.vad.position
+        if self._open_utterance is None or self._partial_in_flight or self.vad.speech_start is None:
+            return
+        if position - self._last_partial_position < int(cfg.SAMPLE_RATE * cfg.PARTIAL_INTERVAL_SEC):
+            return
+
+        start = max(self.vad.speech_start, position - int(cfg.SAMPLE_RATE * cfg.PARTIAL_WINDOW_SEC))
+        if not self.ring_buffer.is_valid(start):
+            return
+
+        segment = SpeechSegment(
+            audio=self.ring_buffer.view(start, position).copy(),
+            start=start,
+            end=position,
+            session=self,
+            utterance_id=self._open_utterance,
+            is_partial=True,
+            created_at=time.monotonic())
+        if self.engine.try_submit(segment):
+            self._partial_in_flight = True
+            self._last_partial_position = position
+
+    def _vad_loop(self):
+        while self.is_running:
+            try:
+                # Ждём, пока в буфере появится хотя бы одно новое окно VAD
+                if not self.ring_buffer.wait(self.vad.position + self.vad.window_size, timeout=0.5):
+                    continue
+
+                vad_start = time.perf_counter()
+                events = self.vad.process(self.ring_buffer)
+                _VAD_SECONDS.observe(time.perf_counter() - vad_start)
+
+                for event in events:
+                    if 'abort' in event: # VAD сброшен после переполнения буфера: реплика оборвана
+                        utterance_id, self._open_utterance = self._open_utterance, None
+                        if utterance_id is not None:
+                            logging.warning("Реплика оборвана: аудио вытеснено из кольцевого буфера до обработки VAD.")
+                            self._close_partials(utterance_id)
+                        continue
+
+                    if 'end' not in event: # Начало речи, ждём завершения сегмента
+                        self._open_utterance = next(self._utterance_ids)
+                        self._last_partial_position = event['start']
+                        continue
+
+                    utterance_id = self._open_utterance
+                    self._open_utterance = None
+
+                    if not self.ring_buffer.is_valid(event['start']):
+                        logging.warning("Сегмент речи вытеснен из кольцевого буфера до транскрипции.")
+                        self._close_partials(utterance_id)
+                        continue
+
+                    # Копируем сегмент: декодирование идёт асинхронно, а буфер продолжает перезаписываться
+                    created_at = time.monotonic()
+                    captured_at = self.ring_buffer.write_time(event['end'])
+                    segment = SpeechSegment(
+                        audio=self.ring_buffer.view(event['start'], event['end']).copy(),
+                        start=event['start'],
+                        end=event['end'],
+                        session=self,
+                        utterance_id=utterance_id,
+                        created_at=created_at,
+                        captured_at=captured_at if captured_at is not None else created_at)
+                    self.finals_submitted += 1 # До постановки: декодер может вернуть результат раньше, чем submit() завершится
+                    if not self.engine.submit(segment):
+                        self.finals_submitted -= 1
+                        self._close_partials(utterance_id)
+
+                if cfg.PARTIALS_ENABLE:
+                    self._submit_partial()
+
+            except Exception as e:
+                logging.error(f"\nПроизошла ошибка в цикле транскрипции сессии '{self.stream_id}': {e}")
+                self.is_running = False
+
+        logging.debug(f"Сессия '{self.stream_id}': поток VAD остановлен.")
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_engine():
+    # Общий движок процесса: модели загружаются при первом обращении
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            engine = STTEngine()
+            if not engine.load():
+                return None
+            engine.start()
+            _default_engine = engine
+        return _default_engine